@@ -4,9 +4,17 @@
 # >> IMPORTS
 # =============================================================================
 # Python
-from binascii  import unhexlify
-from configobj import ConfigObj
-from path      import path
+import cPickle
+import os
+
+from binascii    import unhexlify
+from collections import deque
+from configobj   import ConfigObj
+from heapq       import heappop
+from heapq       import heappush
+from path        import path
+from sys         import getrefcount
+from time        import time
 
 # EventScripts
 import es
@@ -15,6 +23,10 @@ import playerlib
 # Source-Python-Extensions
 import spe
 
+# SPE Effects
+from spe_effects.stats    import Stats
+from spe_effects.recorder import Recorder
+
 
 # =============================================================================
 # >> ADDON INFORMATION
@@ -34,20 +46,54 @@ es.makepublic('spe_effects_version')
 # =============================================================================
 # >> GLOBAL VARIABLES & INITIALIZATION
 # =============================================================================
-MAX_ENTITIES = 32
+__self__ = __import__(__name__)
+
+MAX_ENTITIES = es.ServerVar('spe_effects_max_entities', 32, 'Maximum num' + \
+    'ber of temporary effects per client and update')
+MAX_BACKLOG  = 4096
+OVERFLOW     = 'drop_oldest'
+VECTOR_CHUNK = 256
+
+# Maximum distance between the eyes of a recipient and an effect, if
+# culling is enabled by passing True. VISIBILITY_CHECK can be set to a
+# function, which is called with the user ID, the eye position and the
+# origin of an effect. The recipient is dropped, if it returns False.
+CULL_DISTANCE    = 4096
+VISIBILITY_CHECK = None
+
+# If True, identical effects for the same recipients are only created once
+# per tick. Beams without a taper or fade are equal regardless of their
+# direction. UNDIRECTED holds the ranges of the start and end arguments
+# (without the users) of beams and the position of their width, which is
+# followed by the end width and the fade length.
+DEDUPLICATE = True
+UNDIRECTED  = {
+    'beamEntPoint': ((1, 3), (3, 5), 10),
+    'beamEnts':     ((1, 2), (2, 3), 8),
+    'beamPoints':   ((1, 2), (2, 3), 8),
+}
+
+# Share of the limit, which a spread batch may use per update by default.
+# The rest is left for other effects. See EffectBatch.
+BURST_SHARE = 0.5
+
+PRIORITY_LOW    = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH   = 2
 DATAPATH = path(__file__).parent.joinpath('data')
-EFFECTS  = ConfigObj(DATAPATH.joinpath('effects.ini'))
-POINTERS = ConfigObj(DATAPATH.joinpath('pointers.ini'))
 
-if spe.platform == 'nt':
-    sig, pos = POINTERS['g_TESystem']['nt']
-    g_TESystem = spe.getPointer(sig, int(pos))
+# The parsed INI files are stored in the cache file. It's rewritten, if one
+# of the INI files was modified or CACHE_VERSION was changed.
+DATAFILES     = ('effects.ini', 'pointers.ini', 'precache.ini')
+CACHEFILE     = DATAPATH.joinpath('data.cache')
+CACHE_VERSION = 1
 
-else:
-    sym = POINTERS['g_TESystem']['linux']
-    g_TESystem = spe.getLocVal('i', spe.findSymbol(sym))
+# Seconds required by the steps of the initialization. The natives are
+# resolved on first use (see loadNatives()).
+StartupTimes = {}
 
-spe.parseINI('_libs/python/spe_effects/data/signatures.ini')
+# Resolved by loadNatives()
+g_TESystem = None
 
 
 # =============================================================================
@@ -55,7 +101,7 @@ spe.parseINI('_libs/python/spe_effects/data/signatures.ini')
 # =============================================================================
 def beam(users, delay, start, end, model, halo, startframe, framerate, life,
         width, endwidth, fadelength, amplitude, r, g, b, a, speed,
-        parent=True, queue=True):
+        parent=True, queue=True, priority=PRIORITY_NORMAL, deadline=None):
     '''
     This is a wrapper for beamEnts(), beamPoints() and beamEntPoint(). You can
     pass two entity indexes or an entity index and a cooardinate or even two
@@ -64,28 +110,16 @@ def beam(users, delay, start, end, model, halo, startframe, framerate, life,
     index(es).
     '''
 
-    startindex = 0
-    startorigin = 0
-    endindex = 0
-    endorigin = 0
-
-    if isIndex(start) and parent:
-        startindex = start
-
-    else:
-        startorigin = getLocation(start)
-
-    if isIndex(end) and parent:
-        endindex = end
-
-    else:
-        endorigin = getLocation(end)
+    startindex, startorigin, endindex, endorigin = getBeamEnds(start, end,
+        parent)
 
     beamEntPoint(users, delay, startindex, startorigin, endindex, endorigin,
         model, halo, startframe, framerate, life, width, endwidth, fadelength,
-        amplitude, r, g, b, a, speed, queue=queue)
+        amplitude, r, g, b, a, speed, queue=queue, priority=priority,
+        deadline=deadline)
 
-def radioIcon(users, fDelay, userid, queue=True):
+def radioIcon(users, fDelay, userid, queue=True, priority=PRIORITY_HIGH,
+        deadline=None):
     '''
     Creates an exclamation mark above the player's head.
     '''
@@ -94,8 +128,12 @@ def radioIcon(users, fDelay, userid, queue=True):
         return
 
     player = spe.getPlayer(int(userid))
-    QueueSystem.add(spe.call, ('RadioIcon', IRecipientFilter(users), fDelay,
-        player), queue)
+    recipients = FilterCache.find(users)
+    if Stats.enabled:
+        Stats.created('RadioIcon')
+
+    QueueSystem.add(spe.call, ('RadioIcon', recipients, fDelay, player),
+        queue, priority, deadline, recipients)
 
 
 # =============================================================================
@@ -105,27 +143,115 @@ def createEffect(effect, users, *args, **kw):
     '''
     Creates an effect by name. You better use the wrappers for your scripts.
 
+    Keywords:
+    - queue:    If False, the effect is created instantly.
+    - priority: PRIORITY_LOW, PRIORITY_NORMAL (default) or PRIORITY_HIGH.
+                Pending effects with a higher priority are created first.
+    - deadline: Number of seconds the effect may wait in the queue. If it's
+                still pending after that time, it's discarded.
+    - deduplicate: If False, the effect is created, even if an identical
+                effect was already added during this tick. See DEDUPLICATE.
+
     NOTE:
     This function can just create an effect, if it is a part of the class
     CTempEntsSystem.
     '''
 
-    if effect not in EFFECTS:
-        raise SPEEffectError('Effect "%s" does not exist'% effect)
+    _createEffect(DispatchTable[effect], users, args, kw)
+
+def _createEffect(plan, users, args, kw):
+    '''
+    Internally use only! Converts the arguments by using the given dispatch
+    plan and adds the effect to the queue.
+    '''
 
-    args = (IRecipientFilter(users),) + tuple(map(formatter, args))
-    mapping = EFFECTS[effect]['mapping']
-    if len(mapping) != len(args):
-        raise SPEEffectError('Invalid number of arguments for "' + effect + \
-            '". Given: %i, Required: %i'% (len(args), len(mapping)))
+    recipients = FilterCache.find(users)
+    if DEDUPLICATE and kw.get('deduplicate', True) and \
+            QueueSystem.isDuplicate(plan.key(recipients, args)):
+        return
 
-    def callEffect():
-        func = findVirtualFunc(g_TESystem, int(EFFECTS[effect]['offset']))
-        spe.setCallingConvention('thiscall')
-        spe.callFunction(func, 'p'+mapping+')v', ((g_TESystem,) + args))
+    if Stats.enabled:
+        Stats.created(plan.effect)
+
+    QueueSystem.add(plan, (recipients,) + plan.convert(args),
+        kw.get('queue', True), kw.get('priority', PRIORITY_NORMAL),
+        kw.get('deadline'), recipients)
+
+def createEffects(effects, users, atomic=False, queue=True,
+        priority=PRIORITY_NORMAL, deadline=None, share=None):
+    '''
+    Creates multiple effects for the same users as a single unit of the
+    queue. "effects" has to be an iterable containing tuples of an effect's
+    name and its arguments (without the users). If "atomic" is True, all
+    effects are created during the same update. Otherwise they can be split
+    across multiple updates. For "share" see EffectBatch. For the other
+    keywords see createEffect().
+    '''
+
+    batch = EffectBatch(users, atomic, queue, priority, deadline, share)
+    for effect, args in effects:
+        batch.add(effect, *args)
+
+    batch.commit()
+
+def loadData():
+    '''
+    Returns the effects, pointers and precached models. They are read from
+    the cache file, if it's up to date. Otherwise the INI files are parsed
+    and the cache file is rewritten.
+    '''
+
+    files = [DATAPATH.joinpath(x) for x in DATAFILES]
+    key = (CACHE_VERSION,) + tuple(map(os.path.getmtime, files))
+    try:
+        with open(CACHEFILE, 'rb') as cache:
+            cachekey, data = cPickle.load(cache)
+
+        if cachekey == key:
+            StartupTimes['cached'] = True
+            return data
+
+    # The cache is rebuilt, if it doesn't exist or can't be read
+    except Exception:
+        pass
+
+    effects, pointers, precache = map(ConfigObj, files)
+    data = (dict((name, dict(values)) for name, values in effects.items()),
+        dict((name, dict(values)) for name, values in pointers.items()),
+        precache.as_list('models'))
+
+    try:
+        with open(CACHEFILE, 'wb') as cache:
+            cPickle.dump((key, data), cache, cPickle.HIGHEST_PROTOCOL)
+
+    except IOError:
+        pass
+
+    StartupTimes['cached'] = False
+    return data
+
+def loadNatives():
+    '''
+    Resolves g_TESystem and loads the signatures, if that hasn't been done
+    yet. Returns g_TESystem.
+    '''
+
+    global g_TESystem
+    if g_TESystem is not None:
+        return g_TESystem
+
+    start = time()
+    if spe.platform == 'nt':
+        sig, pos = POINTERS['g_TESystem']['nt']
+        g_TESystem = spe.getPointer(sig, int(pos))
+
+    else:
+        sym = POINTERS['g_TESystem']['linux']
+        g_TESystem = spe.getLocVal('i', spe.findSymbol(sym))
 
-    queue = True if 'queue' not in kw else kw['queue']
-    QueueSystem.add(callEffect, (), queue)
+    spe.parseINI('_libs/python/spe_effects/data/signatures.ini')
+    StartupTimes['natives'] = time() - start
+    return g_TESystem
 
 def findVirtualFunc(pointer, offset):
     '''
@@ -145,14 +271,45 @@ def formatter(value):
     3. The given value, if 1 and 2 is false.
     '''
 
+    if hasattr(value, '__iter__'):
+        return convertPointer(value)
+
+    return convertIndex(value)
+
+def convertPointer(value):
+    '''
+    Returns a Vector, if the given value is iterable. Otherwise the given value
+    is returned (e.g. 0 for a NULL pointer).
+    '''
+
     if hasattr(value, '__iter__'):
         if len(value) > 3:
             raise SPEEffectError('"%s" is not a valid vector'% str(value))
 
         return Vector(*value)
 
-    if str(value).endswith('.vmt') or str(value).endswith('.mdl'):
-        return es.precachemodel(value)
+    return value
+
+def convertIndex(value):
+    '''
+    Returns the model index, if the given value ends with ".vmt" or ".mdl".
+    Otherwise the given value is returned. Already precached paths are
+    looked up in PrecacheCache without checking the extension again.
+    '''
+
+    if value in PrecacheCache:
+        PrecacheCache.hits += 1
+        return PrecacheCache[value]
+
+    if isinstance(value, basestring) and value.endswith(('.vmt', '.mdl')):
+        return PrecacheCache.precache(value)
+
+    return value
+
+def convertValue(value):
+    '''
+    Returns the given value.
+    '''
 
     return value
 
@@ -167,6 +324,26 @@ def getUsers(users):
 
     return playerlib.getUseridList(str(users))
 
+def getArgNames(effect):
+    '''
+    Returns the argument names of the given effect (including the users) by
+    its documentation. Only the first name of alternatives is used.
+    '''
+
+    return [name.split('=')[0].split('/')[0].strip()
+        for name in EFFECTS[effect]['doc'].split(',')]
+
+def getProgressiveOrder(count):
+    '''
+    Returns the indexes of a sequence with the given length ordered by their
+    bit-reversed value. Every prefix of the result is spread evenly across
+    the sequence (e.g. 0, 4, 2, 6, 1, 5, 3, 7 for 8).
+    '''
+
+    bits = max(count - 1, 0).bit_length()
+    return sorted(xrange(count),
+        key=lambda x: int(bin(x)[2:].zfill(bits)[::-1] or '0', 2))
+
 def isIndex(value):
     '''
     Returns False, if the given value is iterable. Otherwise, it returns True.
@@ -177,37 +354,90 @@ def isIndex(value):
 
     return True
 
+def cullUsers(users, origin, cull=True, radius=0):
+    '''
+    Returns a list of user IDs of the given users, which can see an effect
+    at the given origin. "cull" is the maximum distance between their eyes
+    and the effect or True to use CULL_DISTANCE. If the effect has a size,
+    pass the radius of its bounding sphere. Recipients are also dropped, if
+    they fail the VISIBILITY_CHECK.
+    The eye positions are cached during a tick.
+    '''
+
+    x, y, z = origin
+    limit = ((CULL_DISTANCE if cull is True else cull) + radius) ** 2
+    result = []
+    for userid in FilterCache.find(users).users:
+        eye = EyePositions[userid]
+        if (eye[0] - x) ** 2 + (eye[1] - y) ** 2 + (eye[2] - z) ** 2 > limit:
+            continue
+
+        if VISIBILITY_CHECK is None or VISIBILITY_CHECK(userid, eye, origin):
+            result.append(userid)
+
+    return result
+
+def getBeamEnds(start, end, parent):
+    '''
+    Returns the start index, start origin, end index and end origin, which
+    are required by beamEntPoint(), for the given start and end. Indexes are
+    only used, if "parent" is True.
+    '''
+
+    startindex = 0
+    startorigin = 0
+    endindex = 0
+    endorigin = 0
+
+    if isIndex(start) and parent:
+        startindex = start
+
+    else:
+        startorigin = getLocation(start)
+
+    if isIndex(end) and parent:
+        endindex = end
+
+    else:
+        endorigin = getLocation(end)
+
+    return (startindex, startorigin, endindex, endorigin)
+
 def getLocation(value):
     '''
     Returns the given value, if it is an iterable. Otherwise, it tries to get
     a location by using the given value as an index. If no location was found,
-    a tuple of 3 null floats is returned.
+    a tuple of 3 null floats is returned. The locations of entities are
+    cached during a tick.
     '''
 
     if hasattr(value, '__iter__'):
         return value
 
-    origin = es.entitygetvalue(value, 'origin')
-    if not origin:
-        return (0.0, 0.0, 0.0)
+    return Locations.entity(value)
 
-    return map(float, origin.split(' '))
+# Converters for the types of an effect's mapping
+CONVERTERS = {
+    'p': convertPointer,
+    'i': convertIndex,
+    'f': convertValue,
+    'S': convertValue,
+}
 
 def _setupEffectFunction(effect):
     '''
     Interally use only! Setups all effects of CTempEntsSystem as functions!
+    Their dispatch plan is compiled on first use.
     '''
 
-    function = lambda *args, **kw: createEffect(effect, *args, **kw)
-    function.__doc__ = effect + '(' + EFFECTS[effect]['doc'] + ', queue=True)'
+    function = lambda users, *args, **kw: _createEffect(DispatchTable[effect],
+        users, args, kw)
+
+    function.__doc__ = effect + '(' + EFFECTS[effect]['doc'] + \
+        ', queue=True, priority=PRIORITY_NORMAL, deadline=None)'
     function.__name__ = effect
     globals()[effect] = function
 
-# Setups all effects as functions
-for effect in EFFECTS:
-    _setupEffectFunction(effect)
-
-
 # =============================================================================
 # >> CALLBACKS
 # =============================================================================
@@ -218,13 +448,81 @@ def tick_listener():
     https://developer.valvesoftware.com/wiki/Temporary_Entity
 
     It seems that an update is not the server tick, but a client tick?!
+    The limit applies to every client, so it's counted per recipient.
     '''
 
-    QueueSystem.entities = 0
+    if Stats.enabled:
+        Stats.update(QueueSystem.entities)
+
+    QueueSystem.reset()
     QueueSystem.callNext()
+    VectorArena.reclaim()
+    FilterCache.collect()
+    Locations.clear()
+    EyePositions.clear()
 
 es.addons.registerTickListener(tick_listener)
 
+def es_map_start(ev):
+    '''
+    Clears the precache cache, because all indexes are invalid after a map
+    change, and precaches all models of PRECACHE.
+    '''
+
+    PrecacheCache.clear()
+    PrecacheCache.warm(PRECACHE)
+    FilterCache.clear()
+
+es.addons.registerForEvent(__self__, 'es_map_start', es_map_start)
+
+def player_activate(ev):
+    '''
+    Marks all cached recipient filters as stale.
+    '''
+
+    FilterCache.invalidate()
+
+es.addons.registerForEvent(__self__, 'player_activate', player_activate)
+
+def player_disconnect(ev):
+    '''
+    Marks all cached recipient filters as stale and excludes the leaving
+    player from them.
+    '''
+
+    FilterCache.invalidate(ev['userid'])
+
+es.addons.registerForEvent(__self__, 'player_disconnect', player_disconnect)
+
+def player_team(ev):
+    '''
+    Marks all cached recipient filters as stale.
+    '''
+
+    FilterCache.invalidate()
+
+es.addons.registerForEvent(__self__, 'player_team', player_team)
+
+def player_spawn(ev):
+    '''
+    Marks all cached recipient filters as stale, because filters like
+    '#alive' depend on the life state.
+    '''
+
+    FilterCache.invalidate()
+
+es.addons.registerForEvent(__self__, 'player_spawn', player_spawn)
+
+def player_death(ev):
+    '''
+    Marks all cached recipient filters as stale, because filters like
+    '#alive' depend on the life state.
+    '''
+
+    FilterCache.invalidate()
+
+es.addons.registerForEvent(__self__, 'player_death', player_death)
+
 
 # =============================================================================
 # >> CLASSES
@@ -232,10 +530,136 @@ es.addons.registerTickListener(tick_listener)
 class SPEEffectError(Exception): pass
 
 
-class _QueueSystem(list):
+class _EffectPlan(object):
+    '''
+    Holds everything that is required to call an effect of CTempEntsSystem:
+    the signature, the number of arguments and a converter for every
+    argument. The virtual function is resolved on first use.
+    '''
+
+    def __init__(self, effect):
+        '''
+        Compiles the dispatch plan for the given effect.
+        '''
+
+        mapping = EFFECTS[effect]['mapping']
+        self.effect     = effect
+        self.offset     = int(EFFECTS[effect]['offset'])
+        self.signature  = 'p' + mapping + ')v'
+        self.arity      = len(mapping)
+        self.types      = mapping[1:]
+        self.converters = tuple(CONVERTERS.get(x, formatter)
+            for x in self.types)
+        self.function   = None
+        self.ends       = None
+        if effect in UNDIRECTED:
+            (a, b), (c, d), width = UNDIRECTED[effect]
+            self.ends = (a + 2, b + 2, c + 2, d + 2, width + 2)
+
+    def __call__(self, *args):
+        '''
+        Calls the effect with the given (already converted) arguments.
+        '''
+
+        if self.function is None:
+            self.function = findVirtualFunc(loadNatives(), self.offset)
+
+        spe.setCallingConvention('thiscall')
+        spe.callFunction(self.function, self.signature, (g_TESystem,) + args)
+
+    def convert(self, args, converters=None):
+        '''
+        Converts the given arguments (without the recipient filter) by using
+        the converter of each position. You can pass your own converters to
+        replace the default ones.
+        '''
+
+        if len(args) + 1 != self.arity:
+            raise SPEEffectError('Invalid number of arguments for "' + \
+                self.effect + '". Given: %i, Required: %i'% (len(args) + 1,
+                self.arity))
+
+        return tuple([convert(value) for convert, value in
+            zip(converters or self.converters, args)])
+
+    def normalize(self, args):
+        '''
+        Returns the given arguments as a hashable tuple.
+        '''
+
+        return tuple([tuple(value) if hasattr(value, '__iter__') else value
+            for value in args])
+
+    def key(self, recipients, args):
+        '''
+        Returns a key, which is equal for identical effects. See order().
+        '''
+
+        return self.order((self, recipients.users) + self.normalize(args))
+
+    def order(self, key):
+        '''
+        Swaps the start and the end of an undirected beam in the given key,
+        so both directions have the same key. A beam is only undirected, if
+        its width is equal to its end width and it doesn't fade.
+        '''
+
+        if self.ends is None:
+            return key
+
+        a, b, c, d, width = self.ends
+        if key[width] != key[width + 1] or key[width + 2]:
+            return key
+
+        if key[c:d] < key[a:b]:
+            key = key[:a] + key[c:d] + key[b:c] + key[a:b] + key[d:]
+
+        return key
+
+
+class _DispatchTable(dict):
+    '''
+    Stores the compiled dispatch plans by the effect's name. A plan is
+    compiled on first access.
+    '''
+
+    def __missing__(self, effect):
+        '''
+        Compiles the dispatch plan for the given effect.
+        '''
+
+        if effect not in EFFECTS:
+            raise SPEEffectError('Effect "%s" does not exist'% effect)
+
+        plan = self[effect] = _EffectPlan(effect)
+        return plan
+
+DispatchTable = _DispatchTable()
+
+
+class _QueueSystem(object):
     '''
     This is a really cheap queue system for the temporary effects. For more
     information look at the documentation of tick_listener().
+
+    Every client can receive MAX_ENTITIES effects per update. An effect is
+    created as soon as all of its recipients have some room left. If
+    DEDUPLICATE is True, effects which were already added during the same
+    tick are dropped and counted.
+
+    There is a FIFO queue for every priority. Pending effects with a higher
+    priority are created first. Effects, which have exceeded their deadline,
+    are discarded without using the limit of temporary entities. New effects
+    for recipients with pending effects are queued behind them. Pending
+    spread batches (see EffectBatch) don't hold back other effects, because
+    they leave room for them.
+
+    If MAX_BACKLOG effects are pending, OVERFLOW decides what happens with a
+    new one:
+    - 'drop_oldest': The oldest pending effect with the lowest priority is
+                     discarded.
+    - 'drop_newest': The new effect is discarded.
+    - 'reject':      A SPEEffectError is raised.
     '''
 
     def __init__(self):
@@ -244,95 +668,1124 @@ class _QueueSystem(list):
         temporary effects to 0.
         '''
 
+        self.dropped    = 0
+        self.discarded  = 0
+        self.duplicates = 0
+        self.pending   = (deque(), deque(), deque())
+        self.waiting   = {}
+        self.reset()
+
+    def __len__(self):
+        '''
+        Returns the number of pending entries.
+        '''
+
+        return sum(map(len, self.pending))
+
+    def reset(self):
+        '''
+        Resets the number of created temporary effects per recipient and
+        reads the current limit.
+        '''
+
         self.entities = 0
+        self.limit    = int(MAX_ENTITIES)
+        self.used     = {}
+        self.blocked  = set()
+        self.seen     = set()
 
-    def add(self, function, args, queue):
+    def room(self, recipients):
         '''
-        If queue is False, the effect is created instantly. It could happen
-        that the effect is not shown due to the maximum number of temporary
-        entities per update.
-        If queue is True, this function tries to create the effect. If it
-        fails, the creation is added to the end of this list.
+        Returns the number of effects, which can be sent to all given
+        recipients during this update.
         '''
 
-        if not queue:
-            function(*args)
+        if recipients in self.blocked:
+            return 0
 
-        elif self.entities <= MAX_ENTITIES:
-            function(*args)
-            self.entities += 1
+        used = self.used.get
+        room = self.limit
+        for userid in recipients.users:
+            room = min(room, self.limit - used(userid, 0))
 
-        else:
-            self.append((function, args))
+        if room <= 0:
+            self.blocked.add(recipients)
+            return 0
 
-    def callNext(self):
+        return room
+
+    def isDuplicate(self, key):
         '''
-        Calls the next creations and removes them from the queue.
+        Returns True, if an effect with the given key was already added
+        during this tick. Otherwise the key is stored.
         '''
 
-        for function, args in self:
-            if self.entities > MAX_ENTITIES:
-                break
+        if key in self.seen:
+            self.duplicates += 1
+            return True
 
-            function(*args)
-            self.entities += 1
-            self.remove((function, args))
+        self.seen.add(key)
+        return False
 
-QueueSystem = _QueueSystem()
+    def deduplicate(self, effects, keys):
+        '''
+        Returns the given effects without the ones, whose key was already
+        added during this tick.
+        '''
 
+        return [effect for effect, key in zip(effects, keys)
+            if not self.isDuplicate(key)]
 
-class IRecipientFilter(int):
-    '''
-    This class is used to reconstruct the source engine's IRecipientFilter.
-    '''
+    def charge(self, recipients, count=1):
+        '''
+        Counts the given number of created effects for all given recipients.
+        '''
 
-    def __new__(cls, users):
+        used = self.used
+        for userid in recipients.users:
+            used[userid] = used.get(userid, 0) + count
+
+        self.entities += count
+
+    def process(self, entry):
         '''
-        Adds all given users to the new created pointer.
+        Creates as many effects of the given entry as possible. Returns True,
+        if all of its effects were created.
+        An atomic entry is only created, if there's room for all of its
+        effects. If it contains more effects than the limit, it's created at
+        the beginning of an update for its recipients.
         '''
 
-        pointer = spe.alloc(40)
-        spe.call('RecipientFilterConst', pointer)
-        for userid in getUsers(users):
-            player = spe.getPlayer(userid)
-            spe.call('AddRecipient', pointer, player)
+        room = self.room(entry.recipients)
+        if not room:
+            return False
 
-        return super(cls, cls).__new__(cls, pointer)
+        if entry.atomic and entry.cost > room and room < self.limit:
+            return False
 
-    def __init__(self, users):
-        pass
+        self.charge(entry.recipients, entry.dispatch(room))
+        return not entry.cost
 
-    def __del__(self):
+    def add(self, function, args, queue, priority=PRIORITY_NORMAL,
+            deadline=None, recipients=None):
         '''
-        Calls the destructor and frees the memory.
+        If queue is False, the effect is created instantly. It could happen
+        that the effect is not shown due to the maximum number of temporary
+        entities per update.
+        If queue is True, this function tries to create the effect. If it
+        fails or other effects for the same recipients are still pending,
+        the creation is added to the end of the queue.
+        If a deadline (in seconds) is given, the effect is discarded when it
+        is still pending after that time.
+        The recipients (an IRecipientFilter) are used to count the effect.
+        If they are not given, the effect is not limited.
         '''
 
-        spe.call('RecipientFilterDest', self)
-        spe.dealloc(self)
+        self.addEntry(_QueueEntry(function, args, recipients), queue,
+            priority, deadline)
+
+    def addEntry(self, entry, queue, priority=PRIORITY_NORMAL,
+            deadline=None):
+        '''
+        Adds an entry (a _QueueEntry or an EffectBatch) to the queue. See
+        add() for more information.
+        '''
 
+        if Stats.enabled:
+            Stats.enqueued(entry)
 
-class Vector(int):
-    '''
-    This class is used to reconstruct the source engine's Vector.
-    '''
+        if Recorder.active:
+            Recorder.record(entry, queue, priority, deadline)
 
-    def __new__(cls, x=0, y=0, z=0):
+        if not queue:
+            self.charge(entry.recipients, entry.dispatch(entry.cost))
+
+        elif entry.recipients in self.waiting or not self.process(entry):
+            if deadline is not None:
+                entry.deadline = time() + deadline
+
+            self.append(entry, priority)
+            return
+
+        if Stats.enabled:
+            Stats.completed(entry)
+
+    def append(self, entry, priority=PRIORITY_NORMAL):
         '''
-        Creates a pointer and sets the coordinates.
+        Adds the given entry to the end of the queue of the given priority
+        and applies the overflow policy, if the queue is full.
         '''
 
-        pointer = spe.alloc(12)
-        spe.setLocVal('f', pointer,     float(x))
-        spe.setLocVal('f', pointer + 4, float(y))
-        spe.setLocVal('f', pointer + 8, float(z))
-        return super(cls, cls).__new__(cls, pointer)
+        backlog = len(self)
+        if backlog >= MAX_BACKLOG:
+            if OVERFLOW == 'reject':
+                raise SPEEffectError('The queue is full (%i pending entries)'%
+                    backlog)
 
-    def __init__(self, x=0, y=0, z=0):
-        pass
+            self.dropped += 1
+            if OVERFLOW == 'drop_newest':
+                return
 
-    def __del__(self):
+            for pending in self.pending:
+                if pending:
+                    self.release(pending.popleft())
+                    break
+
+        if entry.quota is None:
+            recipients = entry.recipients
+            self.waiting[recipients] = self.waiting.get(recipients, 0) + 1
+
+        self.pending[priority].append(entry)
+        if Stats.enabled:
+            Stats.backlog(backlog + 1)
+
+    def release(self, entry):
         '''
-        Frees the memory.
+        Removes the recipients of the given entry from the waiting ones.
         '''
 
-        spe.dealloc(self)
\ No newline at end of file
+        if entry.quota is not None:
+            return
+
+        recipients = entry.recipients
+        count = self.waiting[recipients] - 1
+        if count:
+            self.waiting[recipients] = count
+
+        else:
+            del self.waiting[recipients]
+
+    def callNext(self):
+        '''
+        Calls the next creations and removes them from the queue. Stale
+        creations are discarded. Creations for recipients without any room
+        left stay in the queue in their original order.
+        '''
+
+        now = time()
+        for pending in reversed(self.pending):
+            deferred = []
+            for x in xrange(len(pending)):
+                entry = pending.popleft()
+                if entry.deadline is not None and entry.deadline < now:
+                    self.release(entry)
+                    self.discarded += 1
+
+                elif self.process(entry):
+                    self.release(entry)
+                    if Stats.enabled:
+                        Stats.completed(entry)
+
+                else:
+                    deferred.append(entry)
+
+            pending.extendleft(reversed(deferred))
+
+QueueSystem = _QueueSystem()
+
+Stats.addGauge('backlog', QueueSystem.__len__)
+Stats.addGauge('dropped', lambda: QueueSystem.dropped)
+Stats.addGauge('discarded', lambda: QueueSystem.discarded)
+Stats.addGauge('duplicates', lambda: QueueSystem.duplicates)
+
+
+class _PrecacheCache(dict):
+    '''
+    Stores the indexes of all precached models and materials by their path.
+    The number of hits and misses is counted to check its efficiency.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the cache by setting the number of hits and misses to 0.
+        '''
+
+        self.hits   = 0
+        self.misses = 0
+
+    def precache(self, model):
+        '''
+        Precaches the given model, stores and returns its index.
+        '''
+
+        self.misses += 1
+        index = self[model] = es.precachemodel(model)
+        return index
+
+    def warm(self, models):
+        '''
+        Precaches all given models, which are not cached yet.
+        '''
+
+        for model in models:
+            if model not in self:
+                self.precache(model)
+
+PrecacheCache = _PrecacheCache()
+
+Stats.addGauge('precache_hits', lambda: PrecacheCache.hits)
+Stats.addGauge('precache_misses', lambda: PrecacheCache.misses)
+
+
+class _FilterCache(dict):
+    '''
+    Stores the recipient filters by the normalized users (a frozenset of user
+    IDs or a playerlib filter), so a single filter is shared by all effects.
+    If a player joins, leaves, changes their team, spawns or dies, all filters
+    are marked as stale and are only rebuilt on their next use, if their
+    recipients have really changed. Filters are reference-counted by Python,
+    so a replaced filter is destroyed after the last queued effect using it
+    was created. Filters of user ID sets (e.g. culled recipients) are removed
+    at the end of every tick, if nothing else uses them anymore.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the cache without any leaving players.
+        '''
+
+        self.leaving = set()
+
+    def find(self, users):
+        '''
+        Returns the recipient filter for the given users.
+        '''
+
+        if hasattr(users, '__iter__'):
+            key = frozenset(map(int, users))
+
+        else:
+            key = str(users)
+
+        recipients = self.get(key)
+        if recipients is None:
+            recipients = self[key] = IRecipientFilter(self.resolve(key))
+
+        elif recipients.stale:
+            users = self.resolve(key)
+            if users == recipients.users:
+                recipients.stale = False
+
+            else:
+                recipients = self[key] = IRecipientFilter(users)
+
+        return recipients
+
+    def resolve(self, key):
+        '''
+        Returns a sorted tuple of user IDs for the given key without leaving
+        players.
+        '''
+
+        return tuple(sorted([userid for userid in getUsers(key)
+            if userid not in self.leaving]))
+
+    def invalidate(self, leaving=None):
+        '''
+        Marks all filters as stale. If a leaving user ID is given, it won't be
+        added to any filter.
+        '''
+
+        if leaving is not None:
+            self.leaving.add(int(leaving))
+
+        for recipients in self.itervalues():
+            recipients.stale = True
+
+    def collect(self):
+        '''
+        Removes the filters of user ID sets, which are only referenced by
+        the cache. Filters of playerlib filters are kept, because there are
+        only a few of them.
+        '''
+
+        for key in [key for key in self if isinstance(key, frozenset)]:
+            if getrefcount(self[key]) <= 2:
+                del self[key]
+
+    def clear(self):
+        '''
+        Removes all filters and leaving players.
+        '''
+
+        super(_FilterCache, self).clear()
+        self.leaving.clear()
+
+FilterCache = _FilterCache()
+
+Stats.addGauge('filters', FilterCache.__len__)
+
+
+class _LocationCache(object):
+    '''
+    Stores the locations of players and entities during a tick. A location
+    is read on first access. If many player locations are required, all of
+    them can be read at once by using refresh().
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the empty cache.
+        '''
+
+        self.players   = {}
+        self.entities  = {}
+        self.refreshed = False
+
+    def player(self, userid):
+        '''
+        Returns the location of the given player.
+        '''
+
+        location = self.players.get(userid)
+        if location is None:
+            location = self.players[userid] = tuple(
+                es.getplayerlocation(userid))
+
+        return location
+
+    def entity(self, index):
+        '''
+        Returns the origin of the given entity or a tuple of 3 null floats,
+        if it has no origin.
+        '''
+
+        origin = self.entities.get(index)
+        if origin is None:
+            origin = es.entitygetvalue(index, 'origin')
+            origin = self.entities[index] = tuple(map(float,
+                origin.split(' '))) if origin else (0.0, 0.0, 0.0)
+
+        return origin
+
+    def refresh(self):
+        '''
+        Reads the locations of all players, if that wasn't done during this
+        tick yet.
+        '''
+
+        if self.refreshed:
+            return
+
+        self.refreshed = True
+        players = self.players
+        for userid in es.getUseridList():
+            if userid not in players:
+                players[userid] = tuple(es.getplayerlocation(userid))
+
+    def clear(self):
+        '''
+        Removes all locations.
+        '''
+
+        self.players.clear()
+        self.entities.clear()
+        self.refreshed = False
+
+Locations = _LocationCache()
+
+
+class _EyePositions(dict):
+    '''
+    Stores the eye positions of the players by their user ID. A position is
+    read on first access and the cache is cleared every tick.
+    '''
+
+    def __missing__(self, userid):
+        '''
+        Reads the eye position of the given player.
+        '''
+
+        x, y, z = Locations.player(userid)
+        eye = self[userid] = (x, y, z + es.getplayerprop(userid,
+            'CBasePlayer.localdata.m_vecViewOffset[2]'))
+
+        return eye
+
+EyePositions = _EyePositions()
+
+
+class _QueueEntry(object):
+    '''
+    Stores a single pending effect.
+    '''
+
+    __slots__ = ('function', 'args', 'recipients', 'deadline', 'cost',
+        'stamp')
+    atomic = True
+    quota  = None
+
+    def __init__(self, function, args, recipients):
+        '''
+        Initializes the entry.
+        '''
+
+        self.function   = function
+        self.args       = args
+        self.recipients = _NO_RECIPIENTS if recipients is None else recipients
+        self.deadline   = None
+        self.cost       = 1
+        self.stamp      = None
+
+    def dispatch(self, room):
+        '''
+        Creates the effect and returns the number of created effects.
+        '''
+
+        self.function(*self.args)
+        self.cost = 0
+        return 1
+
+
+class EffectSequence(object):
+    '''
+    Base class of queue entries, which create a list of converted effects
+    over one or more updates. Subclasses store the effects, the number of
+    created effects ("position"), "atomic" and "quota".
+    '''
+
+    __slots__ = ()
+
+    @property
+    def cost(self):
+        '''
+        Returns the number of effects, which weren't created yet.
+        '''
+
+        return len(self.effects) - self.position
+
+    def dispatch(self, room):
+        '''
+        Creates the next effects and returns the number of created effects.
+        If the sequence isn't atomic, not more than "room" effects are
+        created. If it has a quota, not more than the quota is created.
+        '''
+
+        start = self.position
+        end = len(self.effects)
+        if self.quota is not None:
+            room = min(room, self.quota)
+
+        if not self.atomic:
+            end = min(end, start + room)
+
+        for function, args in self.effects[start:end]:
+            function(*args)
+
+        self.position = end
+        return end - start
+
+
+class EffectBatch(EffectSequence):
+    '''
+    Collects multiple effects for the same users, which are added to the
+    queue as a single unit. The users are resolved only once and equal
+    vectors are converted only once.
+
+    You can add effects by using add() or the effect functions of this
+    instance, which take the same arguments like the module's functions
+    without the users:
+
+        with EffectBatch('#all') as batch:
+            batch.beamPoints(0, start, end, ...)
+            batch.beam(0, start, end, ...)
+
+    The batch is committed when leaving the outermost "with" block. If
+    "atomic" is True, all effects are created during the same update.
+    Otherwise they can be split across multiple updates.
+
+    If you pass a share of the limit (e.g. 0.25) or True (BURST_SHARE) as
+    "share", the batch is spread across multiple updates. It's planned when
+    it's committed: Not more than the share of MAX_ENTITIES is created per
+    update, so the rest is left for other effects. The rows added by
+    addSegments() and addRings() (e.g. the fill of a figure) are created
+    after all other effects (e.g. its frame) in a progressive order (see
+    getProgressiveOrder()), so a partially created figure is complete, but
+    coarse. "ticks" is the planned number of updates. Only queued batches
+    can be spread.
+
+    If "deduplicate" is False, the effects of the batch are created, even if
+    identical effects were already added during this tick.
+    '''
+
+    def __init__(self, users, atomic=False, queue=True,
+            priority=PRIORITY_NORMAL, deadline=None, share=None,
+            deduplicate=True):
+        '''
+        Initializes the batch for the given users.
+        '''
+
+        if share is True:
+            share = BURST_SHARE
+
+        if share and atomic:
+            raise SPEEffectError('An atomic batch can\'t be spread')
+
+        if share and not queue:
+            raise SPEEffectError('A batch, which isn\'t queued, can\'t be ' + \
+                'spread')
+
+        if share and not 0 < share <= 1:
+            raise SPEEffectError('"share" has to be between 0 and 1')
+
+        self.recipients = FilterCache.find(users)
+        self.atomic     = atomic
+        self.share      = share
+        self.deduplicate = deduplicate
+        self.quota      = None
+        self.ticks      = 1
+        self.rows       = []
+        self.options    = (queue, priority, deadline)
+        self.deadline   = None
+        self.effects    = []
+        self.keys       = []
+        self.position   = 0
+        self.vectors    = {}
+        self.converters = {}
+        self.depth      = 0
+        self.committed  = False
+        self.stamp      = None
+
+    def __enter__(self):
+        '''
+        Enters the batch. Batches can be entered multiple times.
+        '''
+
+        self.depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''
+        Commits the batch, if the outermost "with" block was left without an
+        exception.
+        '''
+
+        self.depth -= 1
+        if not self.depth and exc_type is None:
+            self.commit()
+
+    def __getattr__(self, effect):
+        '''
+        Returns a function to add the given effect to this batch.
+        '''
+
+        if effect not in EFFECTS:
+            raise AttributeError(effect)
+
+        return lambda *args: self.add(effect, *args)
+
+    def vector(self, value):
+        '''
+        Returns the converted value. Equal vectors of this batch share the
+        same Vector.
+        '''
+
+        if not hasattr(value, '__iter__'):
+            return value
+
+        key = tuple(value)
+        vector = self.vectors.get(key)
+        if vector is None:
+            vector = self.vectors[key] = convertPointer(key)
+
+        return vector
+
+    def point(self, vertices, index):
+        '''
+        Returns the Vector for the coordinates at the given index of a flat
+        sequence of floats. Equal vectors of this batch share the same Vector.
+        '''
+
+        key = (vertices[index], vertices[index+1], vertices[index+2])
+        vector = self.vectors.get(key)
+        if vector is None:
+            vector = self.vectors[key] = Vector(*key)
+
+        return vector
+
+    def add(self, effect, *args):
+        '''
+        Adds the given effect with the given arguments (without the users) to
+        this batch.
+        '''
+
+        if self.committed:
+            raise SPEEffectError('The batch has already been committed')
+
+        plan = DispatchTable[effect]
+        converters = self.converters.get(plan)
+        if converters is None:
+            converters = self.converters[plan] = tuple(
+                self.vector if x == 'p' else converter
+                for x, converter in zip(plan.types, plan.converters))
+
+        self.effects.append((plan, (self.recipients,) +
+            plan.convert(args, converters)))
+
+        if DEDUPLICATE and self.deduplicate:
+            self.keys.append(plan.key(self.recipients, args))
+
+    def addSegments(self, effect, delay, vertices, *args):
+        '''
+        Adds the given effect for every line of a flat sequence of floats (6
+        per line). The effect's arguments have to start with the delay, the
+        start and the end vector. The other arguments are converted once.
+        '''
+
+        self._addRows(effect, delay, vertices, 6, args,
+            lambda x: (self.point(vertices, x), self.point(vertices, x+3)),
+            lambda x: (tuple(vertices[x:x+3]), tuple(vertices[x+3:x+6])))
+
+    def addRings(self, effect, delay, rings, *args):
+        '''
+        Adds the given effect for every ring of a flat sequence of floats (5
+        per ring: origin, start and end radius). The effect's arguments have
+        to start with the delay, the origin, the start and the end radius.
+        The other arguments are converted once.
+        '''
+
+        self._addRows(effect, delay, rings, 5, args,
+            lambda x: (self.point(rings, x), rings[x+3], rings[x+4]),
+            lambda x: (tuple(rings[x:x+3]), rings[x+3], rings[x+4]))
+
+    def _addRows(self, effect, delay, rows, size, args, getRow, getKey):
+        '''
+        Internally use only! Adds the given effect for every row of a flat
+        sequence of floats. "getRow" returns the converted arguments of a row
+        by its index and "getKey" the hashable ones.
+        '''
+
+        if not len(rows):
+            return
+
+        row = getRow(0)
+        self.rows.append((len(self.effects), len(self.effects) +
+            len(rows) // size))
+
+        self.add(effect, delay, *row + args)
+        plan, first = self.effects[-1]
+        head = first[:2]
+        tail = first[2+len(row):]
+        append = self.effects.append
+        for x in xrange(size, len(rows), size):
+            append((plan, head + getRow(x) + tail))
+
+        if not DEDUPLICATE or not self.deduplicate:
+            return
+
+        head = (plan, self.recipients.users, delay)
+        tail = plan.normalize(args)
+        self.keys[-1] = plan.order(head + getKey(0) + tail)
+        self.keys.extend([plan.order(head + getKey(x) + tail)
+            for x in xrange(size, len(rows), size)])
+
+    def beam(self, delay, start, end, model, halo, startframe, framerate,
+            life, width, endwidth, fadelength, amplitude, r, g, b, a, speed,
+            parent=True):
+        '''
+        Adds a beam to this batch. See beam() for more information.
+        '''
+
+        startindex, startorigin, endindex, endorigin = getBeamEnds(start,
+            end, parent)
+
+        self.add('beamEntPoint', delay, startindex, startorigin, endindex,
+            endorigin, model, halo, startframe, framerate, life, width,
+            endwidth, fadelength, amplitude, r, g, b, a, speed)
+
+    def commit(self):
+        '''
+        Adds this batch to the queue.
+        '''
+
+        if self.committed:
+            return
+
+        self.committed = True
+        if self.share:
+            self.reorder()
+
+        if DEDUPLICATE and self.deduplicate and \
+                len(self.keys) == len(self.effects):
+            self.effects = QueueSystem.deduplicate(self.effects, self.keys)
+            self.keys = []
+
+        if not self.effects:
+            return
+
+        if self.share:
+            self.quota = max(1, int(int(MAX_ENTITIES) * self.share))
+            self.ticks = -(-len(self.effects) // self.quota)
+
+        if Stats.enabled:
+            for plan, args in self.effects:
+                Stats.created(plan.effect)
+
+            if self.share:
+                Stats.count('spread_batches')
+
+        QueueSystem.addEntry(self, *self.options)
+
+    def reorder(self):
+        '''
+        Moves the rows added by addSegments() and addRings() behind all other
+        effects and orders them progressively.
+        '''
+
+        if not self.rows:
+            return
+
+        rows = []
+        for start, end in self.rows:
+            rows.extend(xrange(start, end))
+
+        added = set(rows)
+        order = [x for x in xrange(len(self.effects)) if x not in added]
+        order.extend([rows[x] for x in getProgressiveOrder(len(rows))])
+        self.effects = [self.effects[x] for x in order]
+        if len(self.keys) == len(order):
+            self.keys = [self.keys[x] for x in order]
+
+        self.rows = []
+
+
+class PreparedEffect(object):
+    '''
+    A single effect, which is prepared for repeated calls. Its arguments are
+    converted once and its vectors keep their native memory. patch() only
+    converts the changed values and writes the changed coordinates into the
+    existing vectors:
+
+        ring = PreparedEffect('beamRingPoint', '#all', 0, origin, 0, 350, ...)
+        ring.fire()
+        ring.patch(vOrigin=neworigin, iRed=0)
+        ring.fire()
+
+    Values can be patched by their name of the effect's documentation (see
+    getArgNames()) or by their index (without the users). Calls of fire()
+    are not deduplicated.
+
+    Queued calls, which are still pending, are created with the values they
+    were fired with. If a vector of a pending call is patched, a new Vector
+    is used instead of writing into the existing one.
+    '''
+
+    def __init__(self, effect, users, *args):
+        '''
+        Converts the given arguments (without the users) of the given effect.
+        '''
+
+        self.plan       = DispatchTable[effect]
+        self.users      = users
+        self.recipients = FilterCache.find(users)
+        self.values     = list(self.plan.convert(args))
+        self.indexes    = dict((name, index) for index, name in
+            enumerate(getArgNames(effect)[1:]))
+        self.coords     = {}
+        self.args       = None
+        for index, value in enumerate(args):
+            if isinstance(self.values[index], Vector):
+                self.coords[index] = tuple(map(float, value))
+
+    def patch(self, *args, **kw):
+        '''
+        Changes the values at the given index or with the given name. Pass
+        either an index and a value or the values as keywords.
+        '''
+
+        if args:
+            self.set(*args)
+
+        for name, value in kw.iteritems():
+            index = self.indexes.get(name)
+            if index is None:
+                raise SPEEffectError('"%s" has no argument "%s"'% (
+                    self.plan.effect, name))
+
+            self.set(index, value)
+
+    def set(self, index, value):
+        '''
+        Changes the value at the given index. If it's a vector, only the
+        changed coordinates are written, unless the vector is still used by
+        a pending call.
+        '''
+
+        coords = self.coords.get(index)
+        if coords is not None and hasattr(value, '__iter__'):
+            value = tuple(map(float, value))
+            if len(value) != 3:
+                raise SPEEffectError('"%s" is not a valid vector'% str(value))
+
+            if self.isPending(index):
+                self.values[index] = Vector(*value)
+                self.coords[index] = value
+                self.args = None
+                return
+
+            pointer = self.values[index]
+            for offset, old, new in zip((0, 4, 8), coords, value):
+                if old != new:
+                    spe.setLocVal('f', pointer + offset, new)
+
+            self.coords[index] = value
+            return
+
+        self.values[index] = self.plan.converters[index](value)
+        if isinstance(self.values[index], Vector):
+            self.coords[index] = tuple(map(float, value))
+
+        else:
+            self.coords.pop(index, None)
+
+        self.args = None
+
+    def isPending(self, index):
+        '''
+        Returns True, if the Vector at the given index is used by a pending
+        call. Otherwise it's only referenced by the values and the arguments
+        of the next call.
+        '''
+
+        vector = self.values[index]
+        args = self.args
+        if args is None:
+            return getrefcount(vector) > 3
+
+        return getrefcount(args) > 3 or getrefcount(vector) > 4
+
+    def fire(self, queue=True, priority=PRIORITY_NORMAL, deadline=None):
+        '''
+        Creates the effect with the current values. For the keywords see
+        createEffect().
+        '''
+
+        recipients = FilterCache.find(self.users)
+        args = self.args
+        if args is None or recipients is not self.recipients:
+            self.recipients = recipients
+            args = self.args = (recipients,) + tuple(self.values)
+
+        if Stats.enabled:
+            Stats.created(self.plan.effect)
+
+        QueueSystem.add(self.plan, args, queue, priority, deadline,
+            recipients)
+
+
+class _NoRecipients(object):
+    '''
+    Used for effects without a recipient filter. They are not limited.
+    '''
+
+    users = ()
+
+_NO_RECIPIENTS = _NoRecipients()
+
+
+class IRecipientFilter(int):
+    '''
+    This class is used to reconstruct the source engine's IRecipientFilter.
+    '''
+
+    def __new__(cls, users):
+        '''
+        Adds all given users to the new created pointer.
+        '''
+
+        loadNatives()
+        users = tuple(getUsers(users))
+        pointer = spe.alloc(40)
+        spe.call('RecipientFilterConst', pointer)
+        for userid in users:
+            player = spe.getPlayer(userid)
+            spe.call('AddRecipient', pointer, player)
+
+        self = super(cls, cls).__new__(cls, pointer)
+        self.users = users
+        self.stale = False
+        if Stats.enabled:
+            Stats.count('filters_allocated')
+
+        return self
+
+    def __init__(self, users):
+        pass
+
+    def __del__(self):
+        '''
+        Calls the destructor and frees the memory.
+        '''
+
+        spe.call('RecipientFilterDest', self)
+        spe.dealloc(self)
+
+
+class _VectorArena(object):
+    '''
+    Provides the native memory for Vectors. The memory is allocated in chunks
+    of VECTOR_CHUNK vectors. Released slots are reclaimed at once after the
+    queued effects of a tick were created.
+    '''
+
+    def __init__(self, chunksize):
+        '''
+        Initializes the arena without allocating any memory.
+        '''
+
+        self.chunksize = chunksize
+        self.chunks    = []
+        self.free      = []
+        self.released  = []
+
+    def grow(self):
+        '''
+        Allocates a new chunk and adds its slots to the free ones.
+        '''
+
+        pointer = spe.alloc(12 * self.chunksize)
+        self.chunks.append(pointer)
+        if Stats.enabled:
+            Stats.count('vector_chunks_allocated')
+
+        self.free.extend(xrange(pointer + 12 * (self.chunksize - 1),
+            pointer - 1, -12))
+
+    def acquire(self):
+        '''
+        Returns a pointer to a free slot.
+        '''
+
+        if not self.free:
+            self.grow()
+
+        return self.free.pop()
+
+    def release(self, pointer):
+        '''
+        Marks the given slot as released. It can be reused after the next
+        call of reclaim().
+        '''
+
+        self.released.append(int(pointer))
+
+    def reclaim(self):
+        '''
+        Makes all released slots available again.
+        '''
+
+        if self.released:
+            self.free.extend(self.released)
+            del self.released[:]
+
+VectorArena = _VectorArena(VECTOR_CHUNK)
+
+
+class HeapScheduler(list):
+    '''
+    Runs items at the time they are due. The items are stored in a heap
+    ordered by that time. runDue() has to be called by a tick listener. It
+    passes all items, which are due, to run(), which is implemented by
+    subclasses.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the empty heap.
+        '''
+
+        self.sequence = 0
+
+    def schedule(self, item, delay):
+        '''
+        Schedules the given item to run after the given delay and returns
+        the heap entry, which can be used to cancel it.
+        '''
+
+        return self.push(item, time() + delay)
+
+    def push(self, item, due):
+        '''
+        Schedules the given item to run at the given time and returns the
+        heap entry.
+        '''
+
+        self.sequence += 1
+        entry = [due, self.sequence, item]
+        heappush(self, entry)
+        return entry
+
+    def cancel(self, entry):
+        '''
+        Cancels the given heap entry. It's removed when it's due.
+        '''
+
+        if entry is not None:
+            entry[2] = None
+
+    def runDue(self):
+        '''
+        Runs all items, which are due.
+        '''
+
+        now = time()
+        items = []
+        while self and self[0][0] <= now:
+            item = heappop(self)[2]
+            if item is not None:
+                items.append(item)
+
+        if items:
+            self.run(items)
+
+    def run(self, items):
+        '''
+        Runs the given items, which are due.
+        '''
+
+        raise NotImplementedError
+
+Stats.addGauge('vector_chunks', lambda: len(VectorArena.chunks))
+
+
+class Vector(int):
+    '''
+    This class is used to reconstruct the source engine's Vector.
+    '''
+
+    def __new__(cls, x=0, y=0, z=0):
+        '''
+        Creates a pointer and sets the coordinates.
+        '''
+
+        pointer = VectorArena.acquire()
+        spe.setLocVal('f', pointer,     float(x))
+        spe.setLocVal('f', pointer + 4, float(y))
+        spe.setLocVal('f', pointer + 8, float(z))
+        return super(cls, cls).__new__(cls, pointer)
+
+    def __init__(self, x=0, y=0, z=0):
+        pass
+
+    def __del__(self):
+        '''
+        Returns the memory to the arena.
+        '''
+
+        VectorArena.release(self)
+
+
+# =============================================================================
+# >> INITIALIZATION
+# =============================================================================
+start = time()
+EFFECTS, POINTERS, PRECACHE = loadData()
+StartupTimes['data'] = time() - start
+
+# Setups all effects as functions
+start = time()
+for effect in EFFECTS:
+    _setupEffectFunction(effect)
+
+StartupTimes['functions'] = time() - start
+Stats.addGauge('startup', lambda: StartupTimes)
\ No newline at end of file
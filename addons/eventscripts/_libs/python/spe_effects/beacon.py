@@ -1,38 +1,60 @@
 # =============================================================================
 # >> IMPORTS
 # =============================================================================
+# Python
+import sys
+
+from time import time
+
 # EventScripts
 import es
-import gamethread
 
 # SPE Effects
 from spe_effects import beamRingPoint
+from spe_effects import cullUsers
+from spe_effects import EffectBatch
+from spe_effects import FilterCache
+from spe_effects import HeapScheduler
+from spe_effects import Locations
+from spe_effects import PRIORITY_HIGH
+from spe_effects import SPEEffectError
+from spe_effects.stats import Stats
 
 
 # =============================================================================
 # >> GLOBAL VARIABLES
 # =============================================================================
-__self__ = __import__(__name__)
+# __import__() would return the package, which registers the same events
+__self__ = sys.modules[__name__]
 Beacons  = {}
 
+# If True, beacons with the same interval run at the same time. Beacons for
+# the same recipients share one batch.
+COALESCE = False
+
+# Number of due beacons, at which the locations of all players are read at
+# once
+BULK_LOCATIONS = 8
+
 
 # =============================================================================
 # >> FUNCTIONS
 # =============================================================================
-def create(userid, override=False, **kw):
+def create(userid, override=False, profile='default', **kw):
     '''
     Creates a new beacon for the given player. If you set "override" to True,
     the old beacon is deleted (if it exists) and a new one is created.
-    Otherwise no new beacon is created. You can also change the default values
+    Otherwise no new beacon is created. The beacon takes its values from the
+    given profile (see registerProfile()). You can also change the values
     for the beacon by passing them as keywords or change the attributes of the
-    new created instance:
+    new created instance. Deleting an attribute restores the profile value.
 
-    Values:
+    Values of the default profile:
     - Effect:
         users       = '#all'
         startradius = 0
-        endradius   = 400
-        model       = 'sprites/laser.vmt'
+        endradius   = 350
+        model       = 'sprites/laserbeam.vmt'
         halo        = 0
         startframe  = 0
         framerate   = 255
@@ -46,6 +68,8 @@ def create(userid, override=False, **kw):
         speed       = 1
         flags       = 0
         offset      = {'x':0, 'y': 0, 'z': 5}
+        priority    = PRIORITY_HIGH
+        cull        = None
 
     - Sound:
         sound       = 'buttons/blip1.wav'
@@ -59,6 +83,9 @@ def create(userid, override=False, **kw):
         precallback  = lambda userid, instance: None
         postcallback = lambda userid, instance: None
         destcallback = lambda userid, instance: None
+
+    If "cull" is a maximum distance or True, the ring is only sent to
+    recipients who can see it. See cullUsers().
     '''
 
     if not es.exists('userid', userid):
@@ -70,13 +97,35 @@ def create(userid, override=False, **kw):
             return None
 
         pause(userid)
-        beacon = Beacons[userid] = _Beacon(userid, **kw)
+        beacon = Beacons[userid] = _Beacon(userid, profile, **kw)
 
     else:
-        beacon = Beacon[userid]
+        beacon = Beacons[userid]
 
     return beacon
 
+def registerProfile(name, base='default', **kw):
+    '''
+    Registers a named beacon profile, which can be passed to create(). The
+    profile takes all values of the base profile, which aren't given as
+    keywords. Returns the new profile.
+    '''
+
+    unknown = set(kw).difference(Profiles['default'])
+    if unknown:
+        raise SPEEffectError('Unknown beacon values: %s'% ', '.join(unknown))
+
+    values = dict(Profiles[base])
+    values.update(kw)
+    values['offset'] = _Profile(values['offset'])
+    profile = Profiles[name] = _Profile(values)
+    return profile
+
+def _noCallback(userid, instance):
+    '''
+    Default callback of all beacons.
+    '''
+
 def start(userid):
     '''
     Starts the beacon for the given player, if it exists.
@@ -132,56 +181,131 @@ def stop(userid):
 # =============================================================================
 # >> CLASSES
 # =============================================================================
+class _Profile(dict):
+    '''
+    A read-only dictionary, which holds the values of a beacon profile. It's
+    shared by all beacons using the profile.
+    '''
+
+    def _readonly(self, *args, **kw):
+        '''
+        Raises an error, because profiles can't be changed.
+        '''
+
+        raise SPEEffectError('Beacon profiles are read-only.')
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _readonly
+
+Profiles = {
+    'default': _Profile(
+        users       = '#all',
+        startradius = 0,
+        endradius   = 350,
+        model       = 'sprites/laserbeam.vmt',
+        halo        = 0,
+        startframe  = 0,
+        framerate   = 255,
+        width       = 2,
+        spread      = 0,
+        amplitude   = 0,
+        r           = 255,
+        g           = 255,
+        b           = 255,
+        a           = 255,
+        speed       = 1,
+        flags       = 0,
+        offset      = _Profile(x=0, y=0, z=5),
+        priority    = PRIORITY_HIGH,
+        cull        = None,
+
+        sound       = 'buttons/blip1.wav',
+        soundtype   = 'emitsound',
+        volume      = 1,
+        attenuation = 0.75,
+
+        duration     = 'indefinitely',
+        interval     = 1.5,
+        precallback  = _noCallback,
+        postcallback = _noCallback,
+        destcallback = _noCallback,
+    )
+}
+
+
+# Values, which are precomputed by _Beacon. Changing them rebuilds the cache.
+CACHED_VALUES = frozenset(Profiles['default']).difference(('duration',
+    'offset', 'precallback', 'postcallback', 'destcallback'))
+
+
 class _Beacon(object):
     '''
     This class is used to create a beacon for a player.
 
+    Only values, which differ from the beacon's profile, are stored in the
+    instance. The values used by mainloop() are precomputed and rebuilt
+    after a value was changed. Other attributes can be stored as well. The
+    offset is copied from the profile on first access, so it can be changed
+    in place.
+
     NOTE:
     Don't use the init() function, but the create() function, if you don't
     want multiple beacons at the same time and an error when stopping it!
     '''
 
-    def __init__(self, userid, **kw):
+    __slots__ = ('__userid', '__entry', '__stopped', '__profile',
+        '__cache', '__dict__') + tuple(Profiles['default'])
+
+    def __init__(self, userid, profile='default', **kw):
         '''
         Initializes the beacon for the given player.
         '''
 
+        self.__profile = Profiles[profile]
         self.__userid  = int(userid)
-        self.__name    = 'Beacon: %s'% userid
+        self.__entry   = None
         self.__stopped = True
-
-        self.users       = '#all'
-        self.startradius = 0
-        self.endradius   = 350
-        self.model       = 'sprites/laserbeam.vmt'
-        self.halo        = 0
-        self.startframe  = 0
-        self.framerate   = 255
-        self.width       = 2
-        self.spread      = 0
-        self.amplitude   = 0
-        self.r           = 255
-        self.g           = 255
-        self.b           = 255
-        self.a           = 255
-        self.speed       = 1
-        self.flags       = 0
-        self.offset      = {'x':0, 'y': 0, 'z': 5}
-
-        self.sound       = 'buttons/blip1.wav'
-        self.soundtype   = 'emitsound'
-        self.volume      = 1
-        self.attenuation = 0.75
-
-        self.duration     = 'indefinitely'
-        self.interval     = 1.5
-        self.precallback  = lambda userid, instance: None
-        self.postcallback = lambda userid, instance: None
-        self.destcallback = lambda userid, instance: None
+        self.__cache   = None
 
         for key, value in kw.iteritems():
             setattr(self, key, value)
 
+    def __getattr__(self, name):
+        '''
+        Returns the profile value of all values, which weren't changed.
+        '''
+
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        if name == 'offset':
+            offset = self.offset = dict(self.__profile['offset'])
+            return offset
+
+        try:
+            return self.__profile[name]
+
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        '''
+        Sets the value and invalidates the precomputed values.
+        '''
+
+        object.__setattr__(self, name, value)
+        if name in CACHED_VALUES:
+            object.__setattr__(self, '_Beacon__cache', None)
+
+    def __delattr__(self, name):
+        '''
+        Restores the profile value and invalidates the precomputed values.
+        '''
+
+        object.__delattr__(self, name)
+        if name in CACHED_VALUES:
+            object.__setattr__(self, '_Beacon__cache', None)
+
     def __del__(self):
         '''
         Calls the end callback.
@@ -189,34 +313,76 @@ class _Beacon(object):
 
         self.destcallback(self.__userid, self)
 
-    def __mainloop(self):
+    @property
+    def userid(self):
+        '''
+        Returns the user ID of the beaconed player.
+        '''
+
+        return self.__userid
+
+    def __update(self):
         '''
-        Creates the beacon, plays the sound and calls the callbacks.
+        Precomputes and returns the values used by mainloop().
         '''
 
+        self.__cache = cache = (self.users, self.priority, self.interval,
+            self.cull, (self.startradius, self.endradius, self.model,
+            self.halo, self.startframe, self.framerate, self.interval,
+            self.width, self.spread, self.amplitude, self.r, self.g, self.b,
+            self.a, self.speed, self.flags), self.soundtype, self.sound,
+            self.volume, self.attenuation)
+
+        return cache
+
+    def mainloop(self, location, batch=None):
+        '''
+        Creates the beacon at the given player location, plays the sound and
+        calls the callbacks. Called by the BeaconScheduler.
+        If a batch is given, the ring is added to it.
+        '''
+
+        userid = self.__userid
+        self.__entry = None
         if self.duration != 'indefinitely':
             self.duration -= self.interval
 
         if self.duration <= 0:
-            return stop(self.__userid)
+            return stop(userid)
+
+        self.precallback(userid, self)
+        (users, priority, interval, cull, args, soundtype, sound, volume,
+            attenuation) = self.__cache or self.__update()
 
-        self.precallback(self.__userid, self)
-        origin = es.getplayerlocation(self.__userid)
-        origin = tuple(origin[x]+self.offset[y] for x, y in enumerate('xyz'))
-        beamRingPoint(self.users, 0, origin, self.startradius, self.endradius,
-            self.model, self.halo, self.startframe, self.framerate,
-            self.interval, self.width, self.spread, self.amplitude, self.r,
-            self.g, self.b, self.a, self.speed, self.flags)
+        try:
+            offset = object.__getattribute__(self, 'offset')
 
-        if self.soundtype == 'emitsound':
-            es.emitsound('player', self.__userid, self.sound, self.volume,
-                self.attenuation)
+        except AttributeError:
+            offset = self.__profile['offset']
 
-        elif self.soundtype == 'playsound':
-            es.playsound(self.__userid, self.sound, self.volume)
+        origin = (location[0]+offset['x'], location[1]+offset['y'],
+            location[2]+offset['z'])
+        args = (0, origin) + args
+        if batch is None:
+            if cull:
+                users = cullUsers(users, origin, cull, max(args[2:4]))
 
-        self.postcallback(self.__userid, self)
-        gamethread.delayedname(self.interval, self.__name, self.__mainloop)
+            if users:
+                beamRingPoint(users, priority=priority, deadline=interval,
+                    *args)
+
+        else:
+            batch.beamRingPoint(*args)
+
+        if soundtype == 'emitsound':
+            es.emitsound('player', userid, sound, volume, attenuation)
+
+        elif soundtype == 'playsound':
+            es.playsound(userid, sound, volume)
+
+        self.postcallback(userid, self)
+        if not self.__stopped:
+            self.__entry = BeaconScheduler.schedule(self, self.interval)
 
     def start(self):
         '''
@@ -230,7 +396,8 @@ class _Beacon(object):
         Pauses the beacon.
         '''
 
-        gamethread.cancelDelayed(self.__name)
+        BeaconScheduler.cancel(self.__entry)
+        self.__entry   = None
         self.__stopped = True
 
     def resume(self):
@@ -242,7 +409,7 @@ class _Beacon(object):
             return
 
         self.__stopped = False
-        self.__mainloop()
+        self.__entry   = BeaconScheduler.schedule(self, 0)
 
     def stop(self):
         '''
@@ -253,6 +420,84 @@ class _Beacon(object):
         del Beacons[self.__userid]
 
 
+class _BeaconScheduler(HeapScheduler):
+    '''
+    Runs all beacons by a single tick listener. All beacons, which are due
+    during a tick, are processed as one batch and their player locations are
+    fetched in one pass.
+    '''
+
+    def schedule(self, beacon, delay):
+        '''
+        Schedules the given beacon to run after the given delay and returns
+        the heap entry, which can be used to cancel it. If COALESCE is True,
+        the time is rounded to a multiple of the beacon's interval.
+        '''
+
+        due = time() + delay
+        if COALESCE and beacon.interval > 0:
+            due = round(due / beacon.interval) * beacon.interval
+
+        return self.push(beacon, due)
+
+    def run(self, beacons):
+        '''
+        Runs the given beacons, which are due.
+        '''
+
+        if Stats.enabled:
+            Stats.count('beacon_ticks', len(beacons))
+
+        if len(beacons) >= BULK_LOCATIONS:
+            Locations.refresh()
+
+        locations = [Locations.player(beacon.userid) for beacon in beacons]
+        if not COALESCE:
+            for beacon, location in zip(beacons, locations):
+                beacon.mainloop(location)
+
+            return
+
+        batches = {}
+        for beacon, location in zip(beacons, locations):
+            users = beacon.users
+            if beacon.cull:
+                users = cullUsers(users, location, beacon.cull,
+                    max(beacon.startradius, beacon.endradius))
+
+                if not users:
+                    beacon.mainloop(location)
+                    continue
+
+            key = (FilterCache.find(users), beacon.priority, beacon.interval)
+            batch = batches.get(key)
+            if batch is None:
+                batch = batches[key] = EffectBatch(users,
+                    priority=beacon.priority, deadline=beacon.interval)
+
+            beacon.mainloop(location, batch)
+
+        for batch in batches.itervalues():
+            batch.commit()
+
+BeaconScheduler = _BeaconScheduler()
+
+Stats.addGauge('beacons', Beacons.__len__)
+
+
+# =============================================================================
+# >> CALLBACKS
+# =============================================================================
+def tick_listener():
+    '''
+    Runs all beacons, which are due.
+    '''
+
+    BeaconScheduler.runDue()
+
+es.addons.registerTickListener(tick_listener)
+
+
 # =============================================================================
 # >> GAME EVENTS
 # =============================================================================
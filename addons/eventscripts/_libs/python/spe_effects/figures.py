@@ -1,13 +1,35 @@
 # =============================================================================
 # >> IMPORTS
 # =============================================================================
-# EventScripts
-from vecmath import vector
+# Python
+from array       import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 # SPE Effects
 from spe_effects import *
 
 
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+# Maximum number of values stored by all cached geometry templates
+TEMPLATE_CACHE_SIZE = 65536
+
+# Number of pending queue entries and distance to the nearest recipient, at
+# which the number of steps is halved when using the level of detail
+LOD_BACKLOG  = 64
+LOD_DISTANCE = 1024
+
+# Default tolerance of the geometry optimization of polygon(), square() and
+# box(). None disables it.
+GEOMETRY_TOLERANCE = None
+
+
 # =============================================================================
 # >> FUNCTIONS
 # =============================================================================
@@ -29,10 +51,30 @@ def polygon(points,
         a=255,
         speed=1,
         parent=False,
-        queue=True):
+        queue=True,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        atomic=False,
+        batch=None,
+        cull=None,
+        edges=None,
+        share=None,
+        tolerance=None):
     '''
     Creates a polygon by entity indexes and/or coordinates. If you set
     "parent" to True, all beams are parented to all given indexes.
+    If you pass a batch, the beams are added to it, but it isn't committed.
+    Otherwise they are added to the queue as a single batch.
+    If you pass a maximum distance or True as "cull", recipients who can't
+    see the polygon are dropped. See cullUsers().
+    Edges without a length and edges, which were already drawn, are
+    skipped. You can pass a set as "edges" to share the drawn edges between
+    multiple figures. See getUniqueEdges().
+    If you pass a share of the limit as "share", the figure is spread
+    across multiple updates. See EffectBatch.
+    If you pass a tolerance (or set GEOMETRY_TOLERANCE), points are removed
+    as long as the polygon doesn't move by more than the tolerance. See
+    getSimplifiedPolygon().
     '''
 
     count = len(points)
@@ -40,11 +82,33 @@ def polygon(points,
         raise SPEEffectError('"points" requires at least 3 coordinates an' + \
             'd/or entity indexes, but %i were given'% count)
 
-    points = dict(enumerate(points))
-    for index in points.iterkeys():
-        beam(users, delay, points[index], points.get(index+1, points[0]),
-            model, halo, startframe, framerate, life, width, endwidth,
-            fadelength, amplitude, r, g, b, a, speed, parent, queue)
+    context = OpenBatch
+    if batch is None:
+        if cull:
+            users = getCulledUsers(users, cull, map(getLocation, points))
+            if not users:
+                return
+
+        batch = context = EffectBatch(users, atomic, queue, priority,
+            deadline, share)
+
+    if tolerance is None:
+        tolerance = GEOMETRY_TOLERANCE
+
+    if tolerance is not None:
+        if not parent:
+            points = map(getLocation, points)
+
+        points = getSimplifiedPolygon(points, tolerance)
+        count = len(points)
+
+    with context:
+        for start, end in getUniqueEdges([(points[first], points[second])
+                for first, second in Templates.get('polygon', count)], edges,
+                width == endwidth and not fadelength):
+            batch.beam(delay, start, end, model, halo, startframe, framerate,
+                life, width, endwidth, fadelength, amplitude, r, g, b, a,
+                speed, parent)
 
 def square(start, end,
         frame=True,
@@ -66,39 +130,82 @@ def square(start, end,
         b=255,
         a=255,
         speed=1,
-        queue=True):
+        queue=True,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        atomic=False,
+        batch=None,
+        lod=False,
+        minsteps=1,
+        maxsteps=None,
+        cull=None,
+        share=None,
+        tolerance=None):
     '''
     Creates a simple, rectangular square by entity indexes and/or coordinates.
     You can fill it by setting "fill" to True. If you decided to fill the
     square, you need to set "steps" to the number of lines should be used to
     fill it. You can also disable the frame by setting "frame" to False.
+    If you pass a batch, the beams are added to it, but it isn't committed.
+    Otherwise they are added to the queue as a single batch.
+    If you set "lod" to True, the number of steps is reduced depending on the
+    load of the queue and the distance to the recipients. See getLODSteps().
+    If you pass a maximum distance or True as "cull", recipients who can't
+    see the figure are dropped. See cullUsers().
+    If you pass a share of the limit as "share", the figure is spread
+    across multiple updates. Its frame is created first. See EffectBatch.
+    If you pass a tolerance (or set GEOMETRY_TOLERANCE), edges and fill
+    lines, which aren't longer than the tolerance, are skipped and the fill
+    lines are at least the tolerance apart.
     '''
 
-    start = vector(getLocation(start))
-    end = vector(getLocation(end))
-
-    if frame:
-        p1 = vector(start)
-        p2 = vector(end)
-        p1.z = end.z
-        p2.z = start.z
-        polygon((start, p1, end, p2), users, delay, model, halo, startframe,
-            framerate, life, width, endwidth, fadelength, amplitude, r, g, b,
-            a, speed, queue=queue)
-
-    if not fill:
-        return
-
-    minz = min(start.z, end.z)
-    step = (max(start.z, end.z) - minz) / (steps + 1)
-    end.z = minz
-    start.z = minz
-    for x in xrange(steps):
-        start.z += step
-        end.z += step
-        beamPoints(users, delay, start, end, model, halo, startframe,
-            framerate, life, width, endwidth, fadelength, amplitude, r, g, b,
-            a, speed, queue=queue)
+    sx, sy, sz = getLocation(start)
+    ex, ey, ez = getLocation(end)
+
+    context = OpenBatch
+    if batch is None:
+        if cull:
+            users = getCulledUsers(users, cull, ((sx, sy, sz), (ex, ey, ez)))
+            if not users:
+                return
+
+        batch = context = EffectBatch(users, atomic, queue, priority,
+            deadline, share)
+
+    if lod and fill:
+        steps = getLODSteps(steps, ((sx + ex) / 2.0, (sy + ey) / 2.0,
+            (sz + ez) / 2.0), batch.recipients, minsteps, maxsteps)
+
+    if tolerance is None:
+        tolerance = GEOMETRY_TOLERANCE
+
+    with context:
+        if frame:
+            polygon(((sx, sy, sz), (sx, sy, ez), (ex, ey, ez), (ex, ey, sz)),
+                users, delay, model, halo, startframe, framerate, life, width,
+                endwidth, fadelength, amplitude, r, g, b, a, speed,
+                batch=batch, tolerance=tolerance)
+
+        if not fill or (sx == ex and sy == ey):
+            return
+
+        if tolerance is not None:
+            if ((ex - sx) ** 2 + (ey - sy) ** 2) ** 0.5 <= tolerance:
+                return
+
+            if tolerance > 0:
+                steps = min(steps, int(abs(ez - sz) / tolerance) - 1)
+
+            if steps < 1:
+                return
+
+        minz = min(sz, ez)
+        vertices = getFillVertices(sx, sy, ex, ey, minz, max(sz, ez) - minz,
+            Templates.get('fill', steps))
+
+        batch.addSegments('beamPoints', delay, vertices, model, halo,
+            startframe, framerate, life, width, endwidth, fadelength,
+            amplitude, r, g, b, a, speed)
 
 def box(start, end,
         frame=True,
@@ -120,51 +227,96 @@ def box(start, end,
         b=255,
         a=255,
         speed=1,
-        queue=True):
+        queue=True,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        atomic=False,
+        batch=None,
+        lod=False,
+        minsteps=1,
+        maxsteps=None,
+        cull=None,
+        share=None,
+        tolerance=None):
     '''
     Creates a simple rectangular box by entity indexes and/or coordinates.
     You can fill the walls by setting "fill" to True. If you decided to fill
     the box, you need to set "steps" to the number of lines should be used to
     fill it. You can also disable the frame by setting "frame" to False.
+    If you pass a batch, the beams are added to it, but it isn't committed.
+    Otherwise they are added to the queue as a single batch.
+    If you set "lod" to True, the number of steps is reduced depending on the
+    load of the queue and the distance to the recipients. See getLODSteps().
+    If you pass a maximum distance or True as "cull", recipients who can't
+    see the figure are dropped. See cullUsers().
+    If you pass a share of the limit as "share", the figure is spread
+    across multiple updates. Its frame is created first. See EffectBatch.
+    If you pass a tolerance (or set GEOMETRY_TOLERANCE), the walls and the
+    frame are optimized like the ones of square() and polygon(). See
+    getMergedEdges().
     '''
 
-    start = vector(getLocation(start))
-    end   = vector(getLocation(end))
+    start = tuple(getLocation(start))
+    end   = tuple(getLocation(end))
+    sx, sy, sz = start
+    ex, ey, ez = end
+
+    context = OpenBatch
+    if batch is None:
+        if cull:
+            users = getCulledUsers(users, cull, (start, end))
+            if not users:
+                return
+
+        batch = context = EffectBatch(users, atomic, queue, priority,
+            deadline, share)
 
-    p1 = vector(start)
-    p2 = vector(start)
-    p3 = vector(start)
-    p4 = vector(end)
-    p5 = vector(end)
-    p6 = vector(end)
+    if lod and fill:
+        steps = getLODSteps(steps, ((sx + ex) / 2.0, (sy + ey) / 2.0,
+            (sz + ez) / 2.0), batch.recipients, minsteps, maxsteps, 4)
 
-    p1.x = end.x
-    p2.y = end.y
-    p3.z = end.z
-    p4.x = start.x
-    p5.y = start.y
-    p6.z = start.z
+    p1 = (ex, sy, sz)
+    p2 = (sx, ey, sz)
+    p3 = (sx, sy, ez)
+    p4 = (sx, ey, ez)
+    p5 = (ex, sy, ez)
+    p6 = (ex, ey, sz)
 
     args = (model, halo, startframe, framerate, life, width, endwidth,
         fadelength, amplitude, r, g, b, a, speed)
 
     args2 = (False, fill, steps, users, delay)
 
-    square(start, p4, queue=queue, *args2+args)
-    square(start, p5, queue=queue, *args2+args)
-    square(p1, end, queue=queue, *args2+args)
-    square(p2, end, queue=queue, *args2+args)
+    if tolerance is None:
+        tolerance = GEOMETRY_TOLERANCE
 
-    if not frame:
-        return
+    with context:
+        # Opposite walls are equal, if the box is flat
+        square(start, p4, batch=batch, tolerance=tolerance, *args2+args)
+        square(start, p5, batch=batch, tolerance=tolerance, *args2+args)
+        if sx != ex:
+            square(p1, end, batch=batch, tolerance=tolerance, *args2+args)
 
-    polygon((start, p1, p5, p3), users, delay, *args)
-    polygon((end, p4, p2, p6), users, delay, *args)
+        if sy != ey:
+            square(p2, end, batch=batch, tolerance=tolerance, *args2+args)
 
-    beamPoints(users, delay, start, p2, queue=queue, *args)
-    beamPoints(users, delay, p1, p6, queue=queue, *args)
-    beamPoints(users, delay, p5, end, queue=queue, *args)
-    beamPoints(users, delay, p3, p4, queue=queue, *args)
+        if not frame:
+            return
+
+        edges = set()
+        polygon((start, p1, p5, p3), users, delay, batch=batch, edges=edges,
+            tolerance=tolerance, *args)
+
+        polygon((end, p4, p2, p6), users, delay, batch=batch, edges=edges,
+            tolerance=tolerance, *args)
+
+        connections = ((start, p2), (p1, p6), (p5, end), (p3, p4))
+        if tolerance is not None:
+            connections = getMergedEdges(connections, tolerance)
+
+        for first, second in getUniqueEdges(connections, edges,
+                width == endwidth and not fadelength):
+            batch.beamPoints(delay, first, second, *args)
 
 def ball(origin, radius,
         steps=15,
@@ -186,30 +338,454 @@ def ball(origin, radius,
         flags=0,
         upper=True,
         lower=True,
-        queue=True):
+        queue=True,
+        priority=PRIORITY_NORMAL,
+        deadline=None,
+        atomic=False,
+        batch=None,
+        lod=False,
+        minsteps=1,
+        maxsteps=None,
+        cull=None,
+        share=None):
     '''
     Creates a ball by an entity index or coordinate and a radius.
 
+    If you pass a batch, the rings are added to it, but it isn't committed.
+    Otherwise they are added to the queue as a single batch.
+    If you set "lod" to True, the number of steps is reduced depending on the
+    load of the queue and the distance to the recipients. See getLODSteps().
+    If you pass a maximum distance or True as "cull", recipients who can't
+    see the figure are dropped. See cullUsers().
+    If you pass a share of the limit as "share", the figure is spread
+    across multiple updates. See EffectBatch.
+
     NOTE:
     The number of steps is used for the lower and upper half.
     '''
 
-    step = float(radius) / steps
-    for x in xrange(steps):
-        dist = step * x
-        org = vector(origin)
-        org.z += dist
-        rad = 2 * radius * (1 - (float(x) / steps) ** 2) ** 0.5
+    ox, oy, oz = getLocation(origin)
+    context = OpenBatch
+    if batch is None:
+        if cull:
+            users = cullUsers(users, (ox, oy, oz), cull, radius)
+            if not users:
+                return
+
+        batch = context = EffectBatch(users, atomic, queue, priority,
+            deadline, share)
 
-        args = (users, delay, org, rad, rad-0.1, model, halo, startframe,
+    if lod:
+        steps = getLODSteps(steps, (ox, oy, oz), batch.recipients, minsteps,
+            maxsteps, bool(upper) + bool(lower))
+    rings = getBallRings(ox, oy, oz, radius, Templates.get('ball', steps),
+        upper, lower)
+
+    with context:
+        batch.addRings('beamRingPoint', delay, rings, model, halo, startframe,
             framerate, life, width, spread, amplitude, r, g, b, a, speed,
             flags)
 
-        if upper:
-            beamRingPoint(queue=queue, *args)
 
-        if not x or not lower:
+def getLODSteps(steps, origin, recipients, minsteps=1, maxsteps=None,
+        cost=1):
+    '''
+    Returns the number of steps, which should be used for a figure at the
+    given origin. "cost" is the number of effects per step.
+    The number of steps is reduced, if
+    - the queue has a backlog (halved at LOD_BACKLOG pending entries),
+    - the recipients don't have enough room left during this update for all
+      effects (reduced by up to 50%),
+    - the nearest recipient is farther away than LOD_DISTANCE (halved at the
+      double distance).
+    The result is limited by "minsteps" and "maxsteps" (default: "steps").
+    '''
+
+    if maxsteps is None:
+        maxsteps = steps
+
+    factor = float(LOD_BACKLOG) / (LOD_BACKLOG + len(QueueSystem))
+
+    effects = steps * cost
+    room = QueueSystem.room(recipients)
+    if room < effects:
+        factor *= float(room + effects) / (2 * effects)
+
+    distance = getNearestDistance(origin, recipients.users)
+    if distance is None:
+        return minsteps
+
+    if distance > LOD_DISTANCE:
+        factor *= LOD_DISTANCE / distance
+
+    return max(minsteps, min(maxsteps, int(round(steps * factor))))
+
+def getNearestDistance(origin, users):
+    '''
+    Returns the distance between the given origin and the nearest player of
+    the given user IDs. If no user ID was given, None is returned.
+    '''
+
+    x, y, z = origin
+    distances = []
+    for userid in users:
+        px, py, pz = Locations.player(userid)
+        distances.append(((px - x) ** 2 + (py - y) ** 2 + (pz - z) ** 2))
+
+    return min(distances) ** 0.5 if distances else None
+
+def getUniqueEdges(edges, drawn=None, undirected=True):
+    '''
+    Returns a list of the given edges (tuples of two points) without edges,
+    which have no length or are equal to a previous one. If you pass a set
+    as "drawn", edges in it are skipped and the returned ones are added to
+    it. Edges are only equal in any direction, if "undirected" is True. Pass
+    False for beams, which are tapered or fade.
+    '''
+
+    if drawn is None:
+        drawn = set()
+
+    result = []
+    for start, end in edges:
+        first = tuple(start) if hasattr(start, '__iter__') else start
+        second = tuple(end) if hasattr(end, '__iter__') else end
+        if first == second:
             continue
 
-        org.z -= 2 * dist
-        beamRingPoint(queue=queue, *args)
\ No newline at end of file
+        key = (first, second)
+        if undirected and second < first:
+            key = (second, first)
+
+        if key not in drawn:
+            drawn.add(key)
+            result.append((start, end))
+
+    return result
+
+def getSimplifiedPolygon(points, tolerance):
+    '''
+    Returns the points of a closed polygon without the ones, which aren't
+    required to keep the polygon within the given tolerance:
+    - Points within the tolerance of the previous point are removed.
+    - The Douglas-Peucker algorithm removes points within the tolerance of
+      the line between the remaining ones. So collinear edges are merged.
+    Entity indexes are always kept, because the beams are parented to them.
+    '''
+
+    locations = []
+    for point in points:
+        location = tuple(getLocation(point))
+        if isIndex(point) or not locations or getDistance(location,
+                locations[-1][1]) > tolerance:
+            locations.append((point, location))
+
+    while len(locations) > 1 and not isIndex(locations[-1][0]) and \
+            getDistance(locations[-1][1], locations[0][1]) <= tolerance:
+        locations.pop()
+
+    count = len(locations)
+    if count < 3:
+        return [point for point, location in locations]
+
+    # Start at an entity index or at the first point and close the polygon
+    anchors = [x for x, (point, location) in enumerate(locations)
+        if isIndex(point)]
+
+    first = anchors[0] if anchors else 0
+    locations = locations[first:] + locations[:first+1]
+    anchors = set([x - first for x in anchors] + [0, count])
+    if len(anchors) == 2:
+        origin = locations[0][1]
+        anchors.add(max(xrange(1, count),
+            key=lambda x: getDistance(locations[x][1], origin)))
+
+    keep = set(anchors)
+    anchors = sorted(anchors)
+    stack = zip(anchors, anchors[1:])
+    while stack:
+        start, end = stack.pop()
+        index = None
+        distance = tolerance
+        for x in xrange(start + 1, end):
+            current = getSegmentDistance(locations[x][1], locations[start][1],
+                locations[end][1])
+
+            if current > distance:
+                index, distance = x, current
+
+        if index is not None:
+            keep.add(index)
+            stack.extend(((start, index), (index, end)))
+
+    return [locations[x][0] for x in sorted(keep) if x < count]
+
+def getMergedEdges(edges, tolerance):
+    '''
+    Returns the given edges (tuples of two points) without edges, which
+    aren't longer than the tolerance. Edges, which share a point, are merged
+    into a single edge, if the shared point is within the tolerance of it.
+    Edges with entity indexes are kept as they are.
+    '''
+
+    result = []
+    for start, end in edges:
+        if isIndex(start) or isIndex(end):
+            result.append((start, end))
+
+        else:
+            start, end = tuple(start), tuple(end)
+            distance = getDistance(start, end)
+            if distance > tolerance:
+                result.append((start, end))
+
+    merged = True
+    while merged:
+        merged = False
+        points = {}
+        for index, edge in enumerate(result):
+            if isIndex(edge[0]) or isIndex(edge[1]):
+                continue
+
+            for point in edge:
+                points.setdefault(point, []).append(index)
+
+        for point, indexes in points.iteritems():
+            for x, first in enumerate(indexes):
+                for second in indexes[x+1:]:
+                    start = result[first][result[first][0] == point]
+                    end = result[second][result[second][0] == point]
+                    if start != end and getSegmentDistance(point, start,
+                            end) <= tolerance:
+                        result[first] = (start, end)
+                        del result[second]
+                        merged = True
+                        break
+
+                if merged:
+                    break
+
+            if merged:
+                break
+
+    return result
+
+def getDistance(first, second):
+    '''
+    Returns the distance between the given coordinates.
+    '''
+
+    return ((first[0] - second[0]) ** 2 + (first[1] - second[1]) ** 2 +
+        (first[2] - second[2]) ** 2) ** 0.5
+
+def getSegmentDistance(point, start, end):
+    '''
+    Returns the distance between the given point and the line segment
+    between the given start and end.
+    '''
+
+    direction = [end[x] - start[x] for x in xrange(3)]
+    length = sum([value ** 2 for value in direction])
+    if not length:
+        return getDistance(point, start)
+
+    factor = sum([(point[x] - start[x]) * direction[x]
+        for x in xrange(3)]) / float(length)
+
+    factor = max(0.0, min(1.0, factor))
+    return getDistance(point, [start[x] + factor * direction[x]
+        for x in xrange(3)])
+
+def getCulledUsers(users, cull, points):
+    '''
+    Returns a list of the given users, who can see a figure with the given
+    points. The figure is enclosed by a sphere around the center of the
+    points. See cullUsers() for more information.
+    '''
+
+    count = float(len(points))
+    center = [sum(point[x] for point in points) / count for x in xrange(3)]
+    radius = max([sum((point[x] - center[x]) ** 2 for x in xrange(3))
+        for point in points]) ** 0.5
+
+    return cullUsers(users, center, cull, radius)
+
+
+# =============================================================================
+# >> VERTEX GENERATION
+# =============================================================================
+def getFillVertices(sx, sy, ex, ey, minz, height, factors):
+    '''
+    Returns the coordinates of the start and end point of all lines, which
+    are used to fill a square, as a flat sequence of floats (6 per line).
+    NumPy is used, if it's available.
+    '''
+
+    if numpy is not None:
+        z = minz + height * numpy.asarray(factors, numpy.float64)
+        vertices = numpy.empty((len(factors), 6), numpy.float64)
+        vertices[:, 0] = sx
+        vertices[:, 1] = sy
+        vertices[:, 2] = z
+        vertices[:, 3] = ex
+        vertices[:, 4] = ey
+        vertices[:, 5] = z
+        return vertices.ravel().tolist()
+
+    vertices = array('d')
+    for factor in factors:
+        z = minz + height * factor
+        vertices.extend((sx, sy, z, ex, ey, z))
+
+    return vertices
+
+def getBallRings(ox, oy, oz, radius, factors, upper=True, lower=True):
+    '''
+    Returns the origin, start and end diameter of all rings of a ball as a
+    flat sequence of floats (5 per ring). The rings are ordered by their
+    distance to the origin and the upper ring comes first. NumPy is used, if
+    it's available.
+    '''
+
+    steps = len(factors)
+    step = float(radius) / steps
+    if numpy is not None:
+        dist = step * numpy.arange(steps, dtype=numpy.float64)
+        rad = radius * numpy.asarray(factors, numpy.float64)
+        halves = []
+        if upper:
+            halves.append((oz + dist, rad))
+
+        if lower:
+            halves.append(((oz - dist)[1:], rad[1:]))
+
+        rings = numpy.empty((sum([len(z) for z, r in halves]), 5),
+            numpy.float64)
+
+        rings[:, 0] = ox
+        rings[:, 1] = oy
+        if len(halves) == 2:
+            # Upper ring first, then the upper and lower ring of every step
+            (uz, ur), (lz, lr) = halves
+            rings[0, 2], rings[0, 3] = uz[0], ur[0]
+            rings[1::2, 2], rings[1::2, 3] = uz[1:], ur[1:]
+            rings[2::2, 2], rings[2::2, 3] = lz, lr
+
+        elif halves:
+            rings[:, 2], rings[:, 3] = halves[0]
+
+        rings[:, 4] = rings[:, 3] - 0.1
+
+        return rings.ravel().tolist()
+
+    rings = array('d')
+    for x, factor in enumerate(factors):
+        dist = step * x
+        rad = radius * factor
+        if upper:
+            rings.extend((ox, oy, oz + dist, rad, rad-0.1))
+
+        if x and lower:
+            rings.extend((ox, oy, oz - dist, rad, rad-0.1))
+
+    return rings
+
+
+# =============================================================================
+# >> GEOMETRY TEMPLATES
+# =============================================================================
+def _polygonTemplate(count):
+    '''
+    Returns the indexes of the start and end point of every edge of a
+    polygon with the given number of points.
+    '''
+
+    return tuple([(x, (x + 1) % count) for x in xrange(count)])
+
+def _fillTemplate(steps):
+    '''
+    Returns the relative heights of the lines, which are used to fill a
+    square.
+    '''
+
+    return tuple([float(x + 1) / (steps + 1) for x in xrange(steps)])
+
+def _ballTemplate(steps):
+    '''
+    Returns the relative diameter of every ring of a half ball.
+    '''
+
+    return tuple([2 * (1 - (float(x) / steps) ** 2) ** 0.5
+        for x in xrange(steps)])
+
+
+# =============================================================================
+# >> CLASSES
+# =============================================================================
+class _TemplateCache(object):
+    '''
+    Stores the normalized geometry of the figures by their shape and number
+    of steps, so they only need to be scaled and translated. If the cached
+    templates contain more than "capacity" values, the least recently used
+    ones are removed.
+    '''
+
+    builders = {
+        'polygon': _polygonTemplate,
+        'fill':    _fillTemplate,
+        'ball':    _ballTemplate,
+    }
+
+    def __init__(self, capacity):
+        '''
+        Initializes the empty cache.
+        '''
+
+        self.capacity  = capacity
+        self.size      = 0
+        self.templates = OrderedDict()
+
+    def get(self, shape, steps):
+        '''
+        Returns the template for the given shape and number of steps.
+        '''
+
+        key = (shape, steps)
+        template = self.templates.pop(key, None)
+        if template is None:
+            template = self.builders[shape](steps)
+            self.size += len(template)
+            while self.size > self.capacity and self.templates:
+                self.size -= len(self.templates.popitem(False)[1])
+
+        self.templates[key] = template
+        return template
+
+    def clear(self):
+        '''
+        Removes all templates.
+        '''
+
+        self.templates.clear()
+        self.size = 0
+
+Templates = _TemplateCache(TEMPLATE_CACHE_SIZE)
+
+
+class _OpenBatch(object):
+    '''
+    Used in a "with" block instead of a batch, which was passed by the
+    caller, so it isn't committed by the figure.
+    '''
+
+    def __enter__(self):
+        '''
+        Does nothing.
+        '''
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        '''
+        Does nothing. The batch is committed by the caller.
+        '''
+
+OpenBatch = _OpenBatch()
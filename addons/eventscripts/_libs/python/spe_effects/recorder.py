@@ -0,0 +1,422 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+from struct import Struct
+
+# EventScripts
+import es
+import cmdlib
+
+# Source-Python-Extensions
+import spe
+
+# SPE Effects
+import spe_effects
+
+
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+MAGIC   = 'SPER'
+VERSION = 2
+
+# Record types
+FILTER = 0
+EFFECT = 1
+BATCH  = 2
+
+# Struct format of every type of an effect's mapping. Pointers are stored
+# with a flag, which is 1 for a Vector. Other values of a pointer (e.g. 0
+# for a NULL pointer or iSurfacetype of shatterSurface) are stored as an
+# integer.
+FIELDS = {
+    'p': 'Bi3f',
+    'f': 'f',
+    'i': 'i',
+    'S': 'c',
+}
+
+# Type, tick, filter ID and number of users (followed by the user IDs)
+FILTER_RECORD = Struct('<BIHH')
+
+# Type, tick, effect ID, filter ID, options and deadline (followed by the
+# converted arguments)
+EFFECT_HEADER = '<BIHHBf'
+EFFECT_PREFIX = Struct('<BIH')
+
+# Type, tick, number of effects, filter ID, options, deadline and atomic
+BATCH_RECORD = Struct('<BIIHBfB')
+
+FILE_HEADER = Struct('<4sBH')
+
+
+# =============================================================================
+# >> FUNCTIONS
+# =============================================================================
+def getStruct(mapping):
+    '''
+    Returns the Struct of an effect record for the given mapping.
+    '''
+
+    return Struct(EFFECT_HEADER + ''.join(FIELDS[x] for x in mapping[1:]))
+
+def packOptions(queue, priority):
+    '''
+    Returns the options byte for the given queue flag and priority.
+    '''
+
+    return priority | (bool(queue) << 2)
+
+def unpackOptions(options):
+    '''
+    Returns the queue flag and the priority of the given options byte.
+    '''
+
+    return bool(options & 4), options & 3
+
+def readVector(pointer):
+    '''
+    Returns the coordinates of the given Vector.
+    '''
+
+    return (spe.getLocVal('f', pointer), spe.getLocVal('f', pointer + 4),
+        spe.getLocVal('f', pointer + 8))
+
+
+# =============================================================================
+# >> CALLBACKS
+# =============================================================================
+def record_command(args):
+    '''
+    spe_effects_record <filename>|stop
+
+    Starts recording all queued effects to the given file or stops the
+    recording.
+    '''
+
+    if not args:
+        es.dbgmsg(0, 'Syntax: spe_effects_record <filename>|stop')
+
+    elif args[0].lower() == 'stop':
+        Recorder.stop()
+
+    else:
+        Recorder.start(args[0])
+
+cmdlib.registerServerCommand('spe_effects_record', record_command,
+    'Records all queued effects of SPE Effects to a file')
+
+
+# =============================================================================
+# >> CLASSES
+# =============================================================================
+class _Recorder(object):
+    '''
+    Writes every effect, which is added to the queue, to a binary log. Each
+    effect is a record of a fixed size, which depends on its mapping. The
+    recipients are written once as a separate record and are referred by
+    their ID. Effects of a batch follow a batch record.
+    Effects, which aren't a part of CTempEntsSystem (e.g. radioIcon()), are
+    not recorded.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the inactive recorder.
+        '''
+
+        self.active  = False
+        self.file    = None
+        self.ticks   = 0
+        self.filters = {}
+        self.effects = {}
+
+    def start(self, filename):
+        '''
+        Starts recording to the given file. A running recording is stopped.
+        '''
+
+        self.stop()
+        names = sorted(spe_effects.EFFECTS)
+        self.file = open(filename, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, len(names)))
+        for index, name in enumerate(names):
+            mapping = spe_effects.EFFECTS[name]['mapping']
+            self.file.write(chr(len(name)) + name + chr(len(mapping)) +
+                mapping)
+
+            self.effects[name] = (index, getStruct(mapping))
+
+        self.ticks   = 0
+        self.active  = True
+        es.addons.registerTickListener(self.tick_listener)
+
+    def stop(self):
+        '''
+        Stops recording and closes the file.
+        '''
+
+        if not self.active:
+            return
+
+        es.addons.unregisterTickListener(self.tick_listener)
+        self.active = False
+        self.file.close()
+        self.file = None
+        self.filters.clear()
+        self.effects.clear()
+
+    def tick_listener(self):
+        '''
+        Counts the ticks of the recording.
+        '''
+
+        self.ticks += 1
+
+    def record(self, entry, queue, priority, deadline):
+        '''
+        Writes the given queue entry (a _QueueEntry or an EffectBatch).
+        '''
+
+        options  = packOptions(queue, priority)
+        deadline = -1 if deadline is None else deadline
+        filterid = self.getFilter(entry.recipients)
+        if hasattr(entry, 'effects'):
+            effects = entry.effects[entry.position:]
+            self.file.write(BATCH_RECORD.pack(BATCH, self.ticks,
+                len(effects), filterid, options, deadline, entry.atomic))
+
+        elif hasattr(entry.function, 'effect'):
+            effects = ((entry.function, entry.args),)
+
+        else:
+            return
+
+        for plan, args in effects:
+            self.writeEffect(plan, args[1:], filterid, options, deadline)
+
+    def getFilter(self, recipients):
+        '''
+        Returns the ID of the given recipients. They are written, if they
+        were not used before.
+        '''
+
+        users = recipients.users
+        filterid = self.filters.get(users)
+        if filterid is None:
+            filterid = self.filters[users] = len(self.filters)
+            self.file.write(FILTER_RECORD.pack(FILTER, self.ticks, filterid,
+                len(users)))
+
+            self.file.write(Struct('<%iH'% len(users)).pack(*users))
+
+        return filterid
+
+    def writeEffect(self, plan, args, filterid, options, deadline):
+        '''
+        Writes a single effect with its converted arguments.
+        '''
+
+        index, record = self.effects[plan.effect]
+        values = [EFFECT, self.ticks, index, filterid, options, deadline]
+        for kind, value in zip(plan.types, args):
+            if kind == 'p':
+                if isinstance(value, spe_effects.Vector):
+                    values.extend((1, 0))
+                    values.extend(readVector(value))
+
+                else:
+                    values.extend((0, int(value), 0, 0, 0))
+
+            elif kind == 'S':
+                values.append(str(value)[:1] or '\0')
+
+            else:
+                values.append(value)
+
+        self.file.write(record.pack(*values))
+
+Recorder = _Recorder()
+
+
+class Replayer(object):
+    '''
+    Reads a log written by the recorder and feeds its effects back to the
+    queue. The log is read completely on initialization.
+
+    Use start() to replay the effects at real speed (one recorded tick per
+    server tick) or feed() to add all effects up to a given tick at once.
+    '''
+
+    def __init__(self, filename):
+        '''
+        Reads all records of the given file.
+        '''
+
+        self.records  = []
+        self.users    = set()
+        self.position = 0
+        self.ticks    = 0
+        self.running  = False
+        with open(filename, 'rb') as log:
+            self.read(log.read())
+
+    def __len__(self):
+        '''
+        Returns the number of records, which weren't replayed yet.
+        '''
+
+        return len(self.records) - self.position
+
+    def read(self, data):
+        '''
+        Parses the given log and stores its records as tuples of the tick,
+        the record type and its values.
+        '''
+
+        magic, version, count = FILE_HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise spe_effects.SPEEffectError('Unsupported effect log')
+
+        offset = FILE_HEADER.size
+        effects = []
+        for x in xrange(count):
+            size = ord(data[offset])
+            name = data[offset+1:offset+1+size]
+            offset += size + 1
+            size = ord(data[offset])
+            mapping = data[offset+1:offset+1+size]
+            offset += size + 1
+            effects.append((name, mapping[1:], getStruct(mapping)))
+
+        filters = {}
+        batch = None
+        remaining = 0
+        while offset < len(data):
+            kind = ord(data[offset])
+            if kind == FILTER:
+                kind, tick, filterid, size = FILTER_RECORD.unpack_from(data,
+                    offset)
+
+                offset += FILTER_RECORD.size
+                users = Struct('<%iH'% size).unpack_from(data, offset)
+                offset += 2 * size
+                filters[filterid] = users
+                self.users.update(users)
+
+            elif kind == BATCH:
+                (kind, tick, remaining, filterid, options, deadline,
+                    atomic) = BATCH_RECORD.unpack_from(data, offset)
+
+                offset += BATCH_RECORD.size
+                batch = []
+                self.records.append((tick, BATCH, (filters[filterid],
+                    options, deadline, atomic, batch)))
+
+            elif kind == EFFECT:
+                index = EFFECT_PREFIX.unpack_from(data, offset)[2]
+                name, types, record = effects[index]
+                values = record.unpack_from(data, offset)
+                offset += record.size
+                args = self.getArgs(types, values[6:])
+                if remaining:
+                    batch.append((name, args))
+                    remaining -= 1
+
+                else:
+                    self.records.append((values[1], EFFECT,
+                        (filters[values[3]], values[4], values[5], name,
+                        args)))
+
+            else:
+                raise spe_effects.SPEEffectError('Invalid record type %i'%
+                    kind)
+
+    def getArgs(self, types, values):
+        '''
+        Returns the arguments of an effect by the unpacked values of its
+        record.
+        '''
+
+        args = []
+        values = iter(values)
+        for kind in types:
+            if kind == 'p':
+                flag, value, x, y, z = [values.next() for i in xrange(5)]
+                args.append((x, y, z) if flag else value)
+
+            else:
+                args.append(values.next())
+
+        return tuple(args)
+
+    def feed(self, tick=None):
+        '''
+        Adds all effects up to the given recorded tick to the queue. If no
+        tick is given, all remaining effects are added. They aren't
+        deduplicated, because identical effects of different recorded ticks
+        may be added during the same tick.
+        '''
+
+        records = self.records
+        while self.position < len(records):
+            record = records[self.position]
+            if tick is not None and record[0] > tick:
+                break
+
+            self.position += 1
+            users, options, deadline = record[2][:3]
+            queue, priority = unpackOptions(options)
+            deadline = None if deadline < 0 else deadline
+            if record[1] == EFFECT:
+                name, args = record[2][3:]
+                spe_effects.createEffect(name, users, queue=queue,
+                    priority=priority, deadline=deadline, deduplicate=False,
+                    *args)
+
+            else:
+                atomic, effects = record[2][3:]
+                batch = spe_effects.EffectBatch(users, atomic, queue,
+                    priority, deadline, deduplicate=False)
+
+                for name, args in effects:
+                    batch.add(name, *args)
+
+                batch.commit()
+
+    def start(self):
+        '''
+        Replays the remaining effects at real speed.
+        '''
+
+        if self.running:
+            return
+
+        self.running = True
+        if self.position < len(self.records):
+            self.ticks = self.records[self.position][0]
+
+        es.addons.registerTickListener(self.tick_listener)
+
+    def stop(self):
+        '''
+        Stops replaying at real speed.
+        '''
+
+        if not self.running:
+            return
+
+        self.running = False
+        es.addons.unregisterTickListener(self.tick_listener)
+
+    def tick_listener(self):
+        '''
+        Adds the effects of the next recorded tick. Stops at the end of the
+        log.
+        '''
+
+        self.feed(self.ticks)
+        self.ticks += 1
+        if not len(self):
+            self.stop()
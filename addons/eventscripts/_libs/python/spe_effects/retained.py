@@ -0,0 +1,370 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+import sys
+
+from inspect import getargspec
+from inspect import getcallargs
+
+# EventScripts
+import es
+
+# SPE Effects
+from spe_effects import EFFECTS
+from spe_effects import EffectBatch
+from spe_effects import EffectSequence
+from spe_effects import FilterCache
+from spe_effects import getArgNames
+from spe_effects import HeapScheduler
+from spe_effects import PRIORITY_NORMAL
+from spe_effects import QueueSystem
+from spe_effects import SPEEffectError
+from spe_effects import figures
+from spe_effects.stats import Stats
+
+
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+# __import__() would return the package, which registers the same events
+__self__ = sys.modules[__name__]
+Retained = set()
+
+# Number of seconds a retained effect is emitted again before its previous
+# emission expires
+KEEPALIVE_LEAD = 0.1
+
+# Names of the arguments, which are used as the life of a retained effect
+LIFE_NAMES = ('life', 'fLife', 'fTime')
+
+
+# =============================================================================
+# >> FUNCTIONS
+# =============================================================================
+def figure(shape, *args, **kw):
+    '''
+    Creates a retained figure and returns its handle. "shape" is the name of
+    a function of spe_effects.figures (e.g. 'box') or the function itself.
+    All other arguments are passed to the function. The figure is emitted
+    again KEEPALIVE_LEAD seconds before its life expires, until it's removed.
+
+        zone = retained.figure('box', start, end, life=2, r=0)
+        zone.update(end=newend, r=255)
+        zone.remove()
+
+    NOTE:
+    The recipients aren't culled, because the figure is only built once.
+    '''
+
+    if isinstance(shape, basestring):
+        shape = getattr(figures, shape)
+
+    values = getcallargs(shape, *args, **kw)
+    return _RetainedEffect(shape, getargspec(shape).args, values)
+
+def effect(effect, users, *args, **kw):
+    '''
+    Creates a retained effect of CTempEntsSystem by its name and returns its
+    handle. The arguments are the same like the ones of createEffect(). Its
+    life is taken from the argument "fLife" or "fTime". If the effect has no
+    life, pass it as the keyword "life".
+
+    The argument names of the effect's documentation (see getArgNames()) can
+    be passed to update():
+
+        ring = retained.effect('beamRingPoint', '#all', 0, origin, ...)
+        ring.update(vOrigin=neworigin, iRed=0)
+    '''
+
+    if effect not in EFFECTS:
+        raise SPEEffectError('Effect "%s" does not exist'% effect)
+
+    names = getArgNames(effect)
+    if len(args) + 1 != len(names):
+        raise SPEEffectError('Invalid number of arguments for "' + effect + \
+            '". Given: %i, Required: %i'% (len(args) + 1, len(names)))
+
+    values = dict(zip(names, (users,) + args), queue=True,
+        priority=PRIORITY_NORMAL, deadline=None, atomic=False, life=None)
+
+    setValues(values, kw)
+
+    def build(batch, **values):
+        batch.add(effect, *[values[name] for name in names[1:]])
+
+    return _RetainedEffect(build, names, values)
+
+def getLife(values):
+    '''
+    Returns the life of a retained effect by its values.
+    '''
+
+    for name in LIFE_NAMES:
+        if values.get(name) is not None:
+            return float(values[name])
+
+    raise SPEEffectError('A retained effect requires a life')
+
+def setValues(values, kw):
+    '''
+    Updates the values of a retained effect by the given keywords. Raises a
+    SPEEffectError for unknown names.
+    '''
+
+    unknown = set(kw).difference(values)
+    if unknown:
+        raise SPEEffectError('Unknown values: %s'% ', '.join(unknown))
+
+    values.update(kw)
+
+def removeAll():
+    '''
+    Removes all retained effects.
+    '''
+
+    for handle in list(Retained):
+        handle.remove()
+
+
+# =============================================================================
+# >> CLASSES
+# =============================================================================
+class _CaptureBatch(EffectBatch):
+    '''
+    A batch, which is never committed. It's used to convert the effects of a
+    retained effect.
+    '''
+
+    def commit(self):
+        '''
+        Does nothing. The effects are emitted by the retained effect.
+        '''
+
+
+class _RetainedEffect(object):
+    '''
+    A shape or effect, which is built once and emitted again by the
+    KeepAliveScheduler before it expires. The converted arguments and their
+    Vectors are kept, so an emission only costs the dispatch.
+
+    NOTE:
+    Temporary effects can't be destroyed. After update() or remove() the
+    previous emission is still visible until its life expires.
+    '''
+
+    def __init__(self, function, names, values):
+        '''
+        Builds and emits the retained effect. "function" adds the effects to
+        the batch, which is passed as the keyword "batch", and takes all
+        values as keywords.
+        '''
+
+        self.function   = function
+        self.names      = names
+        self.values     = values
+        self.entry      = None
+        self.emission   = None
+        self.emitting   = False
+        self.removed    = False
+        self.build()
+        Retained.add(self)
+        self.emit()
+
+    @property
+    def users(self):
+        '''
+        Returns the users of the retained effect.
+        '''
+
+        return self.values['users']
+
+    def build(self):
+        '''
+        Converts all effects by calling the function with the current values.
+        '''
+
+        values = self.values
+        life = getLife(values)
+        if life <= KEEPALIVE_LEAD:
+            raise SPEEffectError('The life of a retained effect has to be ' + \
+                'longer than %s seconds'% KEEPALIVE_LEAD)
+
+        batch = _CaptureBatch(values['users'])
+        self.function(**dict(values, batch=batch))
+        self.life       = life
+        self.effects    = batch.effects
+        self.recipients = batch.recipients
+        self.atomic     = values.get('atomic', False)
+        self.options    = (values.get('queue', True),
+            values.get('priority', PRIORITY_NORMAL), values.get('deadline'))
+
+    def emit(self):
+        '''
+        Adds a new emission to the queue and schedules the next one.
+        '''
+
+        KeepAliveScheduler.cancel(self.entry)
+        self.entry = KeepAliveScheduler.schedule(self,
+            self.life - KEEPALIVE_LEAD)
+
+        recipients = FilterCache.find(self.users)
+        if recipients is not self.recipients:
+            self.recipients = recipients
+            self.effects = [(plan, (recipients,) + args[1:])
+                for plan, args in self.effects]
+
+        if not self.effects:
+            return
+
+        if Stats.enabled:
+            Stats.count('retained_emissions')
+            for plan, args in self.effects:
+                Stats.created(plan.effect)
+
+        self.emission = _Emission(self)
+        self.emitting = True
+        try:
+            QueueSystem.addEntry(self.emission, *self.options)
+
+        finally:
+            self.emitting = False
+
+    def dispatched(self, emission):
+        '''
+        Called when the given emission starts to be created. If it was
+        delayed by the queue, the next emission is scheduled relative to
+        that time.
+        '''
+
+        if emission is self.emission and not self.emitting:
+            KeepAliveScheduler.cancel(self.entry)
+            self.entry = KeepAliveScheduler.schedule(self,
+                self.life - KEEPALIVE_LEAD)
+
+    def update(self, *args, **kw):
+        '''
+        Changes the given values (by position or name), rebuilds the effects
+        and emits them instantly.
+        '''
+
+        if self.removed:
+            raise SPEEffectError('The retained effect has been removed')
+
+        if len(args) > len(self.names):
+            raise SPEEffectError('Too many arguments')
+
+        values = dict(self.values)
+        setValues(values, dict(zip(self.names, args)))
+        setValues(values, kw)
+        previous = self.values
+        self.values = values
+        try:
+            self.build()
+
+        except:
+            self.values = previous
+            raise
+
+        self.emit()
+
+    def remove(self):
+        '''
+        Stops emitting the retained effect. Pending emissions are not
+        created.
+        '''
+
+        if self.removed:
+            return
+
+        self.removed = True
+        KeepAliveScheduler.cancel(self.entry)
+        self.entry    = None
+        self.emission = None
+        self.effects  = []
+        Retained.discard(self)
+
+
+class _Emission(EffectSequence):
+    '''
+    A single emission of a retained effect in the queue. All emissions share
+    the converted effects of their retained effect.
+    '''
+
+    __slots__ = ('handle', 'effects', 'recipients', 'atomic', 'quota',
+        'deadline', 'position', 'stamp')
+
+    def __init__(self, handle):
+        '''
+        Initializes the emission.
+        '''
+
+        self.handle     = handle
+        self.effects    = handle.effects
+        self.recipients = handle.recipients
+        self.atomic     = handle.atomic
+        self.quota      = None
+        self.deadline   = None
+        self.position   = 0
+        self.stamp      = None
+
+    def dispatch(self, room):
+        '''
+        Creates the next effects and returns the number of created effects.
+        Nothing is created, if the retained effect was removed.
+        '''
+
+        if self.handle.removed:
+            self.position = len(self.effects)
+            return 0
+
+        if not self.position:
+            self.handle.dispatched(self)
+
+        return super(_Emission, self).dispatch(room)
+
+
+class _KeepAliveScheduler(HeapScheduler):
+    '''
+    Emits all retained effects by a single tick listener. The heap is
+    ordered by the time their next emission is due.
+    '''
+
+    def run(self, handles):
+        '''
+        Emits the given retained effects, which are due.
+        '''
+
+        for handle in handles:
+            handle.emit()
+
+KeepAliveScheduler = _KeepAliveScheduler()
+
+Stats.addGauge('retained', Retained.__len__)
+
+
+# =============================================================================
+# >> CALLBACKS
+# =============================================================================
+def tick_listener():
+    '''
+    Emits all retained effects, which are due.
+    '''
+
+    KeepAliveScheduler.runDue()
+
+es.addons.registerTickListener(tick_listener)
+
+
+# =============================================================================
+# >> GAME EVENTS
+# =============================================================================
+def es_map_start(ev):
+    '''
+    Removes all retained effects, because their model indexes are invalid
+    after a map change.
+    '''
+
+    removeAll()
+
+es.addons.registerForEvent(__self__, 'es_map_start', es_map_start)
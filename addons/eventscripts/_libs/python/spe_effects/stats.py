@@ -0,0 +1,282 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+import sys
+
+from bisect import bisect_left
+from time   import time
+
+# EventScripts
+import es
+import cmdlib
+
+
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+# Upper bounds of the histogram buckets. Every histogram has an additional
+# bucket for all greater values.
+TICK_BUCKETS  = (0, 1, 2, 4, 8, 16, 32, 64, 128)
+MS_BUCKETS    = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+COUNT_BUCKETS = (0, 1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+
+# =============================================================================
+# >> FUNCTIONS
+# =============================================================================
+def getCaller():
+    '''
+    Returns the name of the first module on the stack, which isn't a part of
+    SPE Effects.
+    '''
+
+    frame = sys._getframe(1)
+    while frame is not None:
+        name = frame.f_globals.get('__name__', '?')
+        if name != 'spe_effects' and not name.startswith('spe_effects.'):
+            return name
+
+        frame = frame.f_back
+
+    return '?'
+
+
+# =============================================================================
+# >> CALLBACKS
+# =============================================================================
+def stats_command(args):
+    '''
+    spe_effects_stats [on|off|reset]
+
+    Enables, disables or resets the statistics. Without an argument all
+    statistics are printed to the console (one "name value" pair per line).
+    '''
+
+    action = args[0].lower() if args else 'dump'
+    if action == 'on':
+        Stats.enable()
+
+    elif action == 'off':
+        Stats.disable()
+
+    elif action == 'reset':
+        Stats.reset()
+
+    else:
+        for line in Stats.dump():
+            es.dbgmsg(0, line)
+
+cmdlib.registerServerCommand('spe_effects_stats', stats_command,
+    'Prints, enables, disables or resets the statistics of SPE Effects')
+
+
+# =============================================================================
+# >> CLASSES
+# =============================================================================
+class _Histogram(object):
+    '''
+    Counts values by fixed buckets and stores their number, sum, minimum and
+    maximum.
+    '''
+
+    def __init__(self, bounds):
+        '''
+        Initializes the histogram with the given upper bounds.
+        '''
+
+        self.bounds  = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.count   = 0
+        self.total   = 0
+        self.minimum = None
+        self.maximum = None
+
+    def add(self, value):
+        '''
+        Adds the given value.
+        '''
+
+        self.buckets[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+
+    def snapshot(self):
+        '''
+        Returns a dictionary containing all values of the histogram.
+        '''
+
+        labels = map(str, self.bounds) + ['inf']
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'min': self.minimum,
+            'max': self.maximum,
+            'buckets': zip(labels, self.buckets),
+        }
+
+
+class _Stats(object):
+    '''
+    Collects statistics of the effects pipeline. Nothing is collected, until
+    the statistics are enabled, so the callers only have to check the
+    "enabled" attribute.
+
+    Gauges are functions, which return a current value (e.g. the number of
+    pending entries). They are called when creating a snapshot.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the disabled statistics.
+        '''
+
+        self.enabled = False
+        self.gauges  = {}
+        self.reset()
+
+    def enable(self):
+        '''
+        Starts collecting statistics.
+        '''
+
+        self.enabled = True
+
+    def disable(self):
+        '''
+        Stops collecting statistics. The collected values are kept.
+        '''
+
+        self.enabled = False
+
+    def reset(self):
+        '''
+        Removes all collected values.
+        '''
+
+        self.started    = time()
+        self.ticks      = 0
+        self.maxbacklog = 0
+        self.counters   = {}
+        self.effects    = {}
+        self.callers    = {}
+        self.latency    = _Histogram(TICK_BUCKETS)
+        self.latencyms  = _Histogram(MS_BUCKETS)
+        self.dispatched = _Histogram(COUNT_BUCKETS)
+
+    def addGauge(self, name, function):
+        '''
+        Adds a gauge, which is read when creating a snapshot.
+        '''
+
+        self.gauges[name] = function
+
+    def count(self, name, value=1):
+        '''
+        Increases the given counter.
+        '''
+
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def created(self, effect, count=1):
+        '''
+        Counts created effects by their name.
+        '''
+
+        self.effects[effect] = self.effects.get(effect, 0) + count
+
+    def enqueued(self, entry):
+        '''
+        Marks the time the given queue entry was added and counts its effects
+        for the calling module.
+        '''
+
+        entry.stamp = (self.ticks, time())
+        caller = getCaller()
+        self.callers[caller] = self.callers.get(caller, 0) + entry.cost
+
+    def completed(self, entry):
+        '''
+        Adds the time the given queue entry has waited to the latency
+        histograms.
+        '''
+
+        if entry.stamp is None:
+            return
+
+        ticks, started = entry.stamp
+        self.latency.add(self.ticks - ticks)
+        self.latencyms.add((time() - started) * 1000)
+
+    def backlog(self, pending):
+        '''
+        Updates the maximum number of pending entries.
+        '''
+
+        if pending > self.maxbacklog:
+            self.maxbacklog = pending
+
+    def update(self, dispatched):
+        '''
+        Called once per tick with the number of effects created during the
+        last update.
+        '''
+
+        self.ticks += 1
+        self.dispatched.add(dispatched)
+
+    def snapshot(self):
+        '''
+        Returns a dictionary containing all statistics.
+        '''
+
+        snapshot = {
+            'enabled': int(self.enabled),
+            'uptime': time() - self.started,
+            'ticks': self.ticks,
+            'backlog_max': self.maxbacklog,
+            'latency_ticks': self.latency.snapshot(),
+            'latency_ms': self.latencyms.snapshot(),
+            'dispatched_per_tick': self.dispatched.snapshot(),
+            'effects': dict(self.effects),
+            'callers': dict(self.callers),
+        }
+
+        snapshot.update(self.counters)
+        for name, function in self.gauges.iteritems():
+            snapshot[name] = function()
+
+        return snapshot
+
+    def dump(self):
+        '''
+        Returns the snapshot as a list of "name value" lines. Nested values
+        are joined by dots.
+        '''
+
+        lines = []
+        self._flatten('spe_effects', self.snapshot(), lines)
+        return lines
+
+    def _flatten(self, prefix, value, lines):
+        '''
+        Internally use only! Adds the lines for the given value.
+        '''
+
+        if isinstance(value, dict):
+            for key in sorted(value):
+                self._flatten(prefix + '.' + str(key), value[key], lines)
+
+        elif isinstance(value, list):
+            for key, item in value:
+                self._flatten(prefix + '.' + key, item, lines)
+
+        else:
+            lines.append('%s %s'% (prefix, value))
+
+Stats = _Stats()
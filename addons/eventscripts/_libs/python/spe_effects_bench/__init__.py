@@ -0,0 +1,14 @@
+'''
+Offline benchmarks for SPE Effects.
+
+The native modules of the server (es, spe, playerlib, gamethread, vecmath
+and cmdlib) are replaced by a fake backend, which counts every native call
+and simulates the server ticks. So the benchmarks can be run without a
+server:
+
+    cd addons/eventscripts/_libs/python
+    python -m spe_effects_bench [benchmark ...]
+
+ConfigObj and path have to be installed. Every result is written as a JSON
+object per line.
+'''
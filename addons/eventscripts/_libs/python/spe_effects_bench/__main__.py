@@ -0,0 +1,14 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+import sys
+
+# SPE Effects Benchmarks
+from spe_effects_bench.suite import run
+
+
+# =============================================================================
+# >> MAIN
+# =============================================================================
+run(sys.argv[1:])
@@ -0,0 +1,347 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+import sys
+
+from types import ModuleType
+
+
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+# Simulated server tick rate
+TICKRATE = 66
+
+# Names of all modules, which are replaced by install()
+MODULES = ('es', 'spe', 'playerlib', 'gamethread', 'vecmath', 'cmdlib')
+
+
+# =============================================================================
+# >> FUNCTIONS
+# =============================================================================
+def install(players=0):
+    '''
+    Replaces es, spe, playerlib, gamethread, vecmath and cmdlib by the fake
+    backend and adds the given number of players. Has to be called before
+    importing spe_effects. Returns the backend.
+    '''
+
+    modules = Backend.modules()
+    for name in MODULES:
+        sys.modules[name] = modules[name]
+
+    Backend.setPlayers(players)
+    return Backend
+
+def useClock(*modules):
+    '''
+    Replaces the time() function of the given modules by the simulated clock.
+    '''
+
+    for module in modules:
+        module.time = Backend.clock
+
+def _module(name, **attributes):
+    '''
+    Internally use only! Returns a new module with the given attributes.
+    '''
+
+    module = ModuleType(name)
+    module.__dict__.update(attributes)
+    return module
+
+
+# =============================================================================
+# >> CLASSES
+# =============================================================================
+class _ServerVar(object):
+    '''
+    A server variable, which only stores its value.
+    '''
+
+    def __init__(self, name, value=0, description=''):
+        '''
+        Initializes the variable with its default value.
+        '''
+
+        self.name  = name
+        self.value = value
+
+    def __int__(self):
+        return int(self.value)
+
+    def __float__(self):
+        return float(self.value)
+
+    def __str__(self):
+        return str(self.value)
+
+    def set(self, value):
+        '''
+        Sets the value.
+        '''
+
+        self.value = value
+
+
+class _Addons(object):
+    '''
+    Stores the registered tick listeners and game events. Like EventScripts,
+    it keeps one callback per module and event, so a module, which is
+    registered twice for an event, replaces its previous callback.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the object without any listeners.
+        '''
+
+        self.ticklisteners = []
+        self.events = {}
+
+    def registerTickListener(self, function):
+        self.ticklisteners.append(function)
+
+    def unregisterTickListener(self, function):
+        self.ticklisteners.remove(function)
+
+    def registerForEvent(self, module, name, function):
+        self.events.setdefault(name, {})[module.__name__] = function
+
+    def unregisterForEvent(self, module, name):
+        self.events.get(name, {}).pop(module.__name__, None)
+
+
+class _Backend(object):
+    '''
+    Simulates the native functions of a server. Every native call is counted
+    by its name, memory is a dictionary and the clock only advances when
+    simulating a tick.
+    '''
+
+    def __init__(self):
+        '''
+        Initializes the backend without any players.
+        '''
+
+        self.addons   = _Addons()
+        self.players  = {}
+        self.memory   = {}
+        self.calls    = {}
+        self.delays   = []
+        self.commands = {}
+        self.pointer  = 0x10000
+        self.now      = 1000000.0
+        self.ticks    = 0
+
+    def count(self, name):
+        '''
+        Counts a native call.
+        '''
+
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    def native(self, name, result=None):
+        '''
+        Returns a function, which counts its calls and returns the given
+        result.
+        '''
+
+        def function(*args):
+            self.count(name)
+            return result
+
+        function.__name__ = name
+        return function
+
+    def resetCalls(self):
+        '''
+        Resets the counted native calls and returns their total number.
+        '''
+
+        total = sum(self.calls.itervalues())
+        self.calls.clear()
+        return total
+
+    def setPlayers(self, count):
+        '''
+        Replaces all players by the given number of players. They are placed
+        on a grid with a distance of 128 units.
+        '''
+
+        self.players = dict((userid, (userid % 16 * 128.0,
+            userid // 16 * 128.0, 0.0)) for userid in xrange(2, count + 2))
+
+    def clock(self):
+        '''
+        Returns the simulated time.
+        '''
+
+        return self.now
+
+    def tick(self, count=1):
+        '''
+        Advances the clock and calls all delays, which are due, and all tick
+        listeners.
+        '''
+
+        for x in xrange(count):
+            self.ticks += 1
+            self.now += 1.0 / TICKRATE
+            due = [delay for delay in self.delays if delay[0] <= self.now]
+            for delay in due:
+                self.delays.remove(delay)
+                delay[1](*delay[2])
+
+            for listener in self.addons.ticklisteners:
+                listener()
+
+    def event(self, name, **ev):
+        '''
+        Fires the given game event.
+        '''
+
+        for function in self.addons.events.get(name, {}).values():
+            function(ev)
+
+    # es
+    def exists(self, kind, userid):
+        self.count('es.exists')
+        try:
+            return int(userid) in self.players
+
+        except ValueError:
+            return False
+
+    def getplayerlocation(self, userid):
+        self.count('es.getplayerlocation')
+        return self.players[int(userid)]
+
+    def entitygetvalue(self, index, name):
+        self.count('es.entitygetvalue')
+        return '0 0 0'
+
+    def precachemodel(self, model):
+        self.count('es.precachemodel')
+        return hash(model) % 1024
+
+    # spe
+    def alloc(self, size):
+        self.count('spe.alloc')
+        pointer = self.pointer
+        self.pointer += size
+        return pointer
+
+    def getLocVal(self, kind, pointer):
+        self.count('spe.getLocVal')
+        return self.memory.get(pointer, 0)
+
+    def setLocVal(self, kind, pointer, value):
+        self.count('spe.setLocVal')
+        self.memory[pointer] = value
+
+    def call(self, name, *args):
+        self.count('spe.call.' + name)
+
+    def callFunction(self, function, signature, args):
+        self.count('spe.callFunction')
+
+    def getPlayer(self, userid):
+        self.count('spe.getPlayer')
+        return 0x1000 + int(userid)
+
+    def getUseridListAll(self):
+        self.count('es.getUseridList')
+        return sorted(self.players)
+
+    # playerlib
+    def getUseridList(self, users):
+        if users.startswith('#'):
+            return sorted(self.players)
+
+        return [int(users)] if self.exists('userid', users) else []
+
+    # gamethread
+    def delayed(self, delay, function, args=(), kw=None):
+        self.delays.append((self.now + delay, function, args))
+
+    def delayedname(self, delay, name, function, args=(), kw=None):
+        self.delays.append((self.now + delay, function, args, name))
+
+    def cancelDelayed(self, name):
+        self.delays = [delay for delay in self.delays
+            if len(delay) < 4 or delay[3] != name]
+
+    # cmdlib
+    def registerServerCommand(self, name, function, description):
+        self.commands[name] = function
+
+    def unregisterServerCommand(self, name):
+        self.commands.pop(name, None)
+
+    def modules(self):
+        '''
+        Returns the fake modules by their names.
+        '''
+
+        es = _module('es',
+            AddonInfo=type('AddonInfo', (object,), {}),
+            ServerVar=_ServerVar,
+            addons=self.addons,
+            set=self.native('es.set'),
+            makepublic=self.native('es.makepublic'),
+            dbgmsg=self.native('es.dbgmsg'),
+            msg=self.native('es.msg'),
+            emitsound=self.native('es.emitsound'),
+            playsound=self.native('es.playsound'),
+            getplayerprop=self.native('es.getplayerprop', 0),
+            getUseridList=self.getUseridListAll,
+            exists=self.exists,
+            getplayerlocation=self.getplayerlocation,
+            entitygetvalue=self.entitygetvalue,
+            precachemodel=self.precachemodel)
+
+        spe = _module('spe',
+            platform='nt',
+            getPointer=self.native('spe.getPointer', 0x2000),
+            findSymbol=self.native('spe.findSymbol', 0),
+            parseINI=self.native('spe.parseINI'),
+            setCallingConvention=self.native('spe.setCallingConvention'),
+            dealloc=self.native('spe.dealloc'),
+            alloc=self.alloc,
+            getLocVal=self.getLocVal,
+            setLocVal=self.setLocVal,
+            call=self.call,
+            callFunction=self.callFunction,
+            getPlayer=self.getPlayer)
+
+        playerlib = _module('playerlib', getUseridList=self.getUseridList)
+        gamethread = _module('gamethread',
+            delayed=self.delayed,
+            delayedname=self.delayedname,
+            cancelDelayed=self.cancelDelayed)
+
+        vecmath = _module('vecmath', vector=_Vector)
+        cmdlib = _module('cmdlib',
+            registerServerCommand=self.registerServerCommand,
+            unregisterServerCommand=self.unregisterServerCommand)
+
+        return dict((module.__name__, module) for module in (es, spe,
+            playerlib, gamethread, vecmath, cmdlib))
+
+Backend = _Backend()
+
+
+class _Vector(list):
+    '''
+    A minimal replacement for vecmath.vector.
+    '''
+
+    def __init__(self, values=(0, 0, 0)):
+        list.__init__(self, map(float, values))
+
+    x = property(lambda self: self[0])
+    y = property(lambda self: self[1])
+    z = property(lambda self: self[2])
+
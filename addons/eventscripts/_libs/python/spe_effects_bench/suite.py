@@ -0,0 +1,347 @@
+# =============================================================================
+# >> IMPORTS
+# =============================================================================
+# Python
+import json
+import sys
+
+from timeit import default_timer
+
+# SPE Effects Benchmarks
+from spe_effects_bench import backend
+
+
+# =============================================================================
+# >> GLOBAL VARIABLES
+# =============================================================================
+# Registered benchmarks in the order they are run
+BENCHMARKS = []
+
+# Arguments of a beamRingPoint without the users
+RING = (0, (0, 0, 0), 0, 350, 'sprites/laser.vmt', 0, 0, 255, 1.5, 2, 0, 0,
+    255, 255, 255, 255, 1, 0)
+
+
+# =============================================================================
+# >> FUNCTIONS
+# =============================================================================
+def benchmark(*variants):
+    '''
+    Registers the decorated function as a benchmark. It's run once for every
+    given dictionary of keywords.
+    '''
+
+    def register(function):
+        for params in variants or ({},):
+            BENCHMARKS.append((function.__name__, function, params))
+
+        return function
+
+    return register
+
+def measure(function, iterations=1):
+    '''
+    Calls the given function the given number of times. Returns the passed
+    seconds and the number of native calls.
+    '''
+
+    backend.Backend.resetCalls()
+    start = default_timer()
+    for x in xrange(iterations):
+        function()
+
+    return default_timer() - start, backend.Backend.resetCalls()
+
+def drain(limit=100000):
+    '''
+    Simulates ticks until the queue is empty. Returns the number of ticks.
+    '''
+
+    import spe_effects
+
+    ticks = 0
+    while len(spe_effects.QueueSystem) and ticks < limit:
+        backend.Backend.tick()
+        ticks += 1
+
+    return ticks
+
+def run(names=None, out=sys.stdout):
+    '''
+    Installs the fake backend, runs all benchmarks (or only the ones with the
+    given names) and writes one JSON object per benchmark and line.
+    '''
+
+    backend.install()
+
+    import spe_effects
+    import spe_effects.beacon
+    import spe_effects.figures
+    import spe_effects.retained
+    import spe_effects.stats
+
+    backend.useClock(spe_effects, spe_effects.beacon, spe_effects.retained,
+        spe_effects.stats)
+    for name, function, params in BENCHMARKS:
+        if names and name not in names:
+            continue
+
+        backend.Backend.setPlayers(params.get('players', 16))
+        spe_effects.FilterCache.clear()
+        result = function(**params)
+        drain()
+
+        result.update(benchmark=name, params=params)
+        if result['iterations']:
+            result['us_per_op'] = result['seconds'] * 1e6 / \
+                result['iterations']
+
+        out.write(json.dumps(result, sort_keys=True) + '\n')
+        out.flush()
+
+    # Destroy the filters while the modules are still available
+    spe_effects.FilterCache.clear()
+
+
+# =============================================================================
+# >> BENCHMARKS
+# =============================================================================
+@benchmark({'queue': False, 'deduplicate': False},
+    {'queue': True, 'deduplicate': False},
+    {'queue': True, 'deduplicate': True})
+def create_effect(queue, deduplicate, iterations=20000):
+    '''
+    Per-call overhead of an effect function. Queued effects are created
+    instantly, because the limit is raised. With deduplication enabled all
+    but the first effect are dropped as duplicates.
+    '''
+
+    import spe_effects
+
+    limit = int(spe_effects.MAX_ENTITIES)
+    spe_effects.MAX_ENTITIES.set(10 ** 9)
+    spe_effects.DEDUPLICATE = deduplicate
+    spe_effects.QueueSystem.reset()
+    seconds, calls = measure(lambda: spe_effects.beamRingPoint('#all',
+        queue=queue, *RING), iterations)
+
+    spe_effects.MAX_ENTITIES.set(limit)
+    spe_effects.DEDUPLICATE = True
+    spe_effects.QueueSystem.reset()
+    return {'iterations': iterations, 'seconds': seconds,
+        'native_calls': calls}
+
+@benchmark({'queue': False, 'patch': False}, {'queue': False, 'patch': True},
+    {'queue': True, 'patch': True})
+def prepared_effect(queue, patch, iterations=20000):
+    '''
+    Per-call overhead of a PreparedEffect. Compare it with create_effect
+    without deduplication. If "patch" is True, the origin is patched before
+    every call.
+    '''
+
+    import spe_effects
+
+    limit = int(spe_effects.MAX_ENTITIES)
+    spe_effects.MAX_ENTITIES.set(10 ** 9)
+    spe_effects.QueueSystem.reset()
+    ring = spe_effects.PreparedEffect('beamRingPoint', '#all', *RING)
+    origins = iter([(x, 0, 0) for x in xrange(iterations)])
+    if patch:
+        def function():
+            ring.patch(1, origins.next())
+            ring.fire(queue)
+
+    else:
+        function = lambda: ring.fire(queue)
+
+    seconds, calls = measure(function, iterations)
+    spe_effects.MAX_ENTITIES.set(limit)
+    spe_effects.QueueSystem.reset()
+    return {'iterations': iterations, 'seconds': seconds,
+        'native_calls': calls}
+
+@benchmark({'players': 1}, {'players': 16}, {'players': 64})
+def recipient_filter(players, iterations=1000):
+    '''
+    Construction of an IRecipientFilter for all players.
+    '''
+
+    import spe_effects
+
+    seconds, calls = measure(lambda: spe_effects.IRecipientFilter('#all'),
+        iterations)
+
+    return {'iterations': iterations, 'seconds': seconds,
+        'native_calls': calls}
+
+@benchmark({'burst': 256}, {'burst': 4096})
+def queue_drain(burst, players=16):
+    '''
+    Enqueues a burst of identical effects and drains the queue by simulated
+    ticks. Deduplication is disabled, so every effect is created.
+    '''
+
+    import spe_effects
+
+    spe_effects.DEDUPLICATE = False
+    enqueue, calls = measure(lambda: spe_effects.beamRingPoint('#all',
+        *RING), burst)
+
+    backend.Backend.resetCalls()
+    start = default_timer()
+    ticks = drain()
+    seconds = default_timer() - start
+    spe_effects.DEDUPLICATE = True
+    return {'iterations': burst, 'seconds': enqueue + seconds,
+        'enqueue_seconds': enqueue, 'drain_seconds': seconds,
+        'ticks': ticks, 'native_calls': calls + backend.Backend.resetCalls()}
+
+@benchmark(
+    {'shape': 'polygon', 'steps': 8},
+    {'shape': 'polygon', 'steps': 32},
+    {'shape': 'square', 'steps': 1},
+    {'shape': 'square', 'steps': 15},
+    {'shape': 'square', 'steps': 64},
+    {'shape': 'box', 'steps': 1},
+    {'shape': 'box', 'steps': 15},
+    {'shape': 'box', 'steps': 64},
+    {'shape': 'ball', 'steps': 4},
+    {'shape': 'ball', 'steps': 15},
+    {'shape': 'ball', 'steps': 64},
+    {'shape': 'circle', 'steps': 64},
+    {'shape': 'circle', 'steps': 64, 'tolerance': 1},
+    {'shape': 'box', 'steps': 64, 'tolerance': 2},
+)
+def figure(shape, steps, tolerance=None, iterations=100):
+    '''
+    Creation of a figure with the given number of steps. The effects are
+    created instantly, so the limit doesn't affect the result. A circle is a
+    polygon with a point per step and a radius of 100. Deduplication is
+    disabled, because the same figure is created repeatedly.
+    '''
+
+    import math
+    import spe_effects
+    from spe_effects import figures
+
+    spe_effects.DEDUPLICATE = False
+    if shape == 'polygon':
+        points = [(x, x * 2, 0) for x in xrange(steps)]
+        create = lambda: figures.polygon(points, queue=False)
+
+    elif shape == 'circle':
+        points = [(100 * math.cos(x * 2 * math.pi / steps),
+            100 * math.sin(x * 2 * math.pi / steps), 0)
+            for x in xrange(steps)]
+
+        create = lambda: figures.polygon(points, queue=False,
+            tolerance=tolerance)
+
+    elif shape == 'ball':
+        create = lambda: figures.ball((0, 0, 0), 100, steps, queue=False)
+
+    else:
+        function = getattr(figures, shape)
+        create = lambda: function((0, 0, 0), (100, 100, 100), fill=True,
+            steps=steps, queue=False, tolerance=tolerance)
+
+    seconds, calls = measure(create, iterations)
+    spe_effects.DEDUPLICATE = True
+    return {'iterations': iterations, 'seconds': seconds,
+        'native_calls': calls}
+
+@benchmark({'players': 64, 'coalesce': False},
+    {'players': 64, 'coalesce': True})
+def beacons(players, coalesce, seconds=10):
+    '''
+    Runs a beacon for every player for the given number of simulated
+    seconds.
+    '''
+
+    from spe_effects import beacon
+
+    beacon.COALESCE = coalesce
+    for userid in backend.Backend.players:
+        beacon.create(userid).start()
+
+    ticks = int(seconds * backend.TICKRATE)
+    seconds, calls = measure(lambda: backend.Backend.tick(), ticks)
+    beacon.round_end(None)
+    beacon.COALESCE = False
+    return {'iterations': ticks, 'seconds': seconds, 'native_calls': calls}
+
+@benchmark({'players': 16})
+def replay(players, ticks=200):
+    '''
+    Records a mixed load of rings and figures for the given number of ticks
+    and replays it at maximum speed.
+    '''
+
+    import os
+    import tempfile
+
+    from spe_effects import beamRingPoint
+    from spe_effects import figures
+    from spe_effects.recorder import Recorder
+    from spe_effects.recorder import Replayer
+
+    handle, filename = tempfile.mkstemp('.bin')
+    os.close(handle)
+    Recorder.start(filename)
+    for tick in xrange(ticks):
+        beamRingPoint('#all', *RING)
+        if not tick % 20:
+            figures.box((0, 0, 0), (100, 100, 100), fill=True)
+
+        backend.Backend.tick()
+
+    Recorder.stop()
+    drain()
+    replayer = Replayer(filename)
+    os.remove(filename)
+
+    backend.Backend.resetCalls()
+    start = default_timer()
+    replayer.feed()
+    ticks = drain()
+    seconds = default_timer() - start
+    return {'iterations': len(replayer.records), 'seconds': seconds,
+        'ticks': ticks, 'native_calls': backend.Backend.resetCalls()}
+
+@benchmark({'shapes': 32, 'retained': False},
+    {'shapes': 32, 'retained': True})
+def keep_alive(shapes, retained, seconds=10, life=1):
+    '''
+    Keeps the given number of filled boxes visible for the given number of
+    simulated seconds. They are either retained or drawn again by a timer
+    like a script would do.
+    '''
+
+    from spe_effects import figures
+    from spe_effects import retained as module
+
+    corners = [((x * 200, 0, 0), (x * 200 + 100, 100, 100))
+        for x in xrange(shapes)]
+
+    interval = int((life - module.KEEPALIVE_LEAD) * backend.TICKRATE)
+    if retained:
+        for start, end in corners:
+            module.figure('box', start, end, fill=True, life=life)
+
+        function = backend.Backend.tick
+
+    else:
+        def function():
+            if not backend.Backend.ticks % interval:
+                for start, end in corners:
+                    figures.box(start, end, fill=True, life=life)
+
+            backend.Backend.tick()
+
+    ticks = int(seconds * backend.TICKRATE)
+    seconds, calls = measure(function, ticks)
+    if retained:
+        module.removeAll()
+
+    return {'iterations': ticks, 'seconds': seconds, 'native_calls': calls}